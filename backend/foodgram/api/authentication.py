@@ -0,0 +1,141 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.fields import related_descriptors
+from django.utils.functional import SimpleLazyObject
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+
+TOKEN_CACHE_STATS = ('local_hits', 'shared_hits', 'misses')
+
+
+def _cache_key(key):
+    # Raw tokens never leave the database, the cache sees only digests.
+    return 'auth_token_owner:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+class TokenCache:
+    """Two-level cache of token owners as (user id, is_active) pairs.
+
+    The first level is a bounded in-process LRU with a short TTL, the
+    second one is the Django cache shared by workers. Revoked tokens are
+    dropped from both levels of the current process and from the shared
+    cache, other workers forget them within AUTH_TOKEN_CACHE_LOCAL_TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = dict.fromkeys(TOKEN_CACHE_STATS, 0)
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            owner, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return owner
+
+    def _set_local(self, key, owner):
+        with self._lock:
+            self._entries[key] = (
+                owner,
+                time.monotonic() + settings.AUTH_TOKEN_CACHE_LOCAL_TTL)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.AUTH_TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        owner = self._get_local(key)
+        if owner is not None:
+            self._count('local_hits')
+            return owner
+        owner = cache.get(_cache_key(key))
+        if owner is not None:
+            self._count('shared_hits')
+            self._set_local(key, owner)
+            return owner
+        self._count('misses')
+        return None
+
+    def set(self, key, user):
+        owner = (user.pk, user.is_active)
+        cache.set(_cache_key(key), owner, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        self._set_local(key, owner)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        cache.delete_many([_cache_key(key) for key in keys])
+
+    def get_stats(self):
+        """Return hit and miss counters of the current process."""
+        with self._lock:
+            return dict(self._stats, size=len(self._entries))
+
+
+token_cache = TokenCache()
+
+
+class CachedUser(SimpleLazyObject):
+    """Token owner known by id, loaded on first use of other fields.
+
+    Primary key, `is_active`, related managers and model checks of
+    querysets and foreign keys work without a query.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id, is_active):
+        super().__init__(lambda: User.objects.get(pk=user_id))
+        stub = User.from_db(
+            User.objects.db, ['id', 'is_active'], [user_id, is_active])
+        self.__dict__.update(
+            _stub=stub, pk=user_id, id=user_id, is_active=is_active,
+            _meta=stub._meta, _state=stub._state)
+
+    @property
+    def __class__(self):
+        return User
+
+    def __getattr__(self, name):
+        if isinstance(getattr(User, name, None),
+                      related_descriptors.ReverseManyToOneDescriptor):
+            return getattr(self._stub, name)
+        return super().__getattr__(name)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication which does not query the database for tokens
+    resolved recently. Disabled by AUTH_TOKEN_CACHE = False."""
+
+    def authenticate_credentials(self, key):
+        if not settings.AUTH_TOKEN_CACHE:
+            return super().authenticate_credentials(key)
+        owner = token_cache.get(key)
+        if owner is not None:
+            user_id, is_active = owner
+            if not is_active:
+                raise exceptions.AuthenticationFailed(
+                    'Пользователь неактивен или удалён.')
+            user = CachedUser(user_id, is_active)
+            return user, Token(key=key, user=user)
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user)
+        return user, token
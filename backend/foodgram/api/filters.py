@@ -1,30 +1,62 @@
 import django_filters
+from django.db.models import Exists, OuterRef
 
-from recipes.models import Recipe, Tag
+from recipes.models import Favorite, Recipe, ShoppingCart, Tag
+from recipes.scores import SCORES
+
+
+def filter_exists(queryset, name, subquery):
+    """Keep only rows for which the correlated subquery finds a match."""
+    return queryset.annotate(**{name: Exists(subquery)}).filter(**{name: True})
 
 
 class RecipeFilter(django_filters.FilterSet):
-    """Custom filter for Recipes."""
+    """Custom filter for Recipes.
+
+    Tags, favorites and shopping cart are checked with `Exists()`
+    subqueries, so filters compose without joins and duplicate rows.
+    `ordering` ranks recipes by scores precomputed in `RecipeScore`.
+    """
     tags = django_filters.ModelMultipleChoiceFilter(
         field_name="tags__slug",
         queryset=Tag.objects.all(),
-        to_field_name="slug",)
+        to_field_name="slug",
+        method='get_tags')
     is_favorited = django_filters.NumberFilter(method='get_is_favorited')
     is_in_shopping_cart = django_filters.NumberFilter(
         method='get_is_in_shopping_cart')
+    ordering = django_filters.ChoiceFilter(
+        choices=[(score, score) for score in SCORES],
+        method='get_ordering')
 
     class Meta:
         model = Recipe
         fields = {'author', }
 
-    def get_is_favorited(self, queryset, name, value):
+    def get_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return filter_exists(
+            queryset, 'has_tags', Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'), tag__in=value))
+
+    def filter_user_relation(self, queryset, name, value, model):
         user = self.request.user
-        if value == 1:
-            return queryset.filter(favorite__user=user)
-        return Recipe.objects.all()
+        if value != 1:
+            return queryset
+        if not user.is_authenticated:
+            return queryset.none()
+        return filter_exists(queryset, name, model.objects.filter(
+            user=user, recipe=OuterRef('pk')))
+
+    def get_is_favorited(self, queryset, name, value):
+        return self.filter_user_relation(
+            queryset, 'in_favorites', value, Favorite)
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
-        if value == 1:
-            return queryset.filter(cart__user=user)
-        return Recipe.objects.all()
+        return self.filter_user_relation(
+            queryset, 'in_shopping_cart', value, ShoppingCart)
+
+    def get_ordering(self, queryset, name, value):
+        return queryset.filter(score__isnull=False).order_by(
+            f'-score__{value}', '-pk')
@@ -0,0 +1,135 @@
+import bisect
+import ipaddress
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+
+from api.authentication import token_cache
+from recipes.cache import get_cart_stats
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+TOTALS = (
+    ('db_queries_total', 'Database queries made.', 'queries'),
+    ('db_duration_seconds_total', 'Time spent in database queries.', 'db'),
+    ('serialize_duration_seconds_total',
+     'Time spent serializing data, without queries.', 'serialize'),
+    ('render_duration_seconds_total', 'Time spent rendering responses.',
+     'render'),
+    ('response_bytes_total', 'Size of response bodies.', 'size'),
+)
+
+
+class ViewStats:
+    def __init__(self):
+        self.requests = defaultdict(int)
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.duration = 0.0
+        self.totals = dict.fromkeys(
+            (key for _, _, key in TOTALS), 0)
+
+
+class Registry:
+    """Process-local request metrics aggregated per view."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = defaultdict(ViewStats)
+
+    def observe(self, view, status, duration, **totals):
+        with self._lock:
+            stats = self._views[view]
+            stats.requests[status] += 1
+            stats.duration += duration
+            position = bisect.bisect_left(DURATION_BUCKETS, duration)
+            if position < len(DURATION_BUCKETS):
+                stats.buckets[position] += 1
+            for key, value in totals.items():
+                stats.totals[key] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [(view, dict(stats.requests), list(stats.buckets),
+                     stats.duration, dict(stats.totals))
+                    for view, stats in sorted(self._views.items())]
+
+
+registry = Registry()
+
+
+def format_sample(name, labels, value):
+    labels = ','.join(f'{key}="{label}"' for key, label in labels)
+    return f'foodgram_{name}{{{labels}}} {value}'
+
+
+def write_metric(lines, name, help_text, metric_type, samples):
+    lines.append(f'# HELP foodgram_{name} {help_text}')
+    lines.append(f'# TYPE foodgram_{name} {metric_type}')
+    lines.extend(format_sample(name, labels, value)
+                 for labels, value in samples)
+
+
+def get_histogram_samples(snapshot):
+    samples = []
+    for view, requests, buckets, duration, _ in snapshot:
+        cumulative = 0
+        for bound, bucket in zip(DURATION_BUCKETS, buckets):
+            cumulative += bucket
+            samples.append(('_bucket', (('view', view), ('le', bound)),
+                            cumulative))
+        count = sum(requests.values())
+        samples.append(('_bucket', (('view', view), ('le', '+Inf')), count))
+        samples.append(('_sum', (('view', view),), duration))
+        samples.append(('_count', (('view', view),), count))
+    return samples
+
+
+def render_metrics():
+    """Render collected metrics in Prometheus text format."""
+    snapshot = registry.snapshot()
+    lines = []
+    write_metric(
+        lines, 'requests_total', 'Requests handled.', 'counter',
+        [((('view', view), ('status', status)), count)
+         for view, requests, _, _, _ in snapshot
+         for status, count in sorted(requests.items())])
+    lines.append('# HELP foodgram_request_duration_seconds Request wall time.')
+    lines.append('# TYPE foodgram_request_duration_seconds histogram')
+    lines.extend(
+        format_sample('request_duration_seconds' + suffix, labels, value)
+        for suffix, labels, value in get_histogram_samples(snapshot))
+    for name, help_text, key in TOTALS:
+        write_metric(lines, name, help_text, 'counter',
+                     [((('view', view),), totals[key])
+                      for view, _, _, _, totals in snapshot])
+    write_metric(lines, 'shopping_cart_cache_total',
+                 'Shopping list cache lookups.', 'counter',
+                 [((('result', stat),), value)
+                  for stat, value in get_cart_stats().items()])
+    write_metric(lines, 'auth_token_cache_total',
+                 'Authentication token cache lookups.', 'counter',
+                 [((('result', stat),), value)
+                  for stat, value in token_cache.get_stats().items()
+                  if stat != 'size'])
+    return '\n'.join(lines) + '\n'
+
+
+def is_internal(address):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network)
+               for network in settings.PERFORMANCE_METRICS_NETWORKS)
+
+
+def metrics(request):
+    """Metrics for scrapers of internal networks and for staff only."""
+    if not (request.user.is_staff
+            or is_internal(request.META.get('REMOTE_ADDR', ''))):
+        raise PermissionDenied
+    return HttpResponse(render_metrics(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,138 @@
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from rest_framework.serializers import BaseSerializer
+
+from api.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RequestMetrics:
+    """Timings of one request, filled by the middleware hooks."""
+
+    def __init__(self):
+        self.view = 'unresolved'
+        self.queries = Counter()
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.serializing = False
+
+    def record_query(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries[sql] += 1
+
+
+def time_serializer_data(data):
+    """Wrap the `data` property to measure serialization of requests.
+
+    Only the outermost call is measured, nested serializers are part of
+    it. Queries made while serializing, e.g. by a lazy queryset, are
+    counted as database time only.
+    """
+    @functools.wraps(data.fget)
+    def get_data(serializer):
+        metrics = getattr(_local, 'metrics', None)
+        if metrics is None or metrics.serializing:
+            return data.fget(serializer)
+        metrics.serializing = True
+        started, db = time.perf_counter(), metrics.db
+        try:
+            return data.fget(serializer)
+        finally:
+            metrics.serializing = False
+            metrics.serialize += (
+                time.perf_counter() - started - (metrics.db - db))
+
+    get_data.timed = True
+    return property(get_data)
+
+
+def get_view_name(view_func, method):
+    """Name views as `RecipesViewSet.list` or by the function name."""
+    view_class = getattr(view_func, 'cls', None)
+    if view_class is None:
+        return getattr(view_func, '__qualname__', repr(view_func))
+    actions = getattr(view_func, 'actions', None) or {}
+    method = method.lower()
+    return f'{view_class.__name__}.{actions.get(method, method)}'
+
+
+class PerformanceMiddleware:
+    """Measure wall, database, serialization and render time of requests.
+
+    Enabled with PERFORMANCE_METRICS = True. Serialization is measured in
+    `data` of DRF serializers, rendering from the template response hook
+    to its post-render callback. Timings go to the
+    `Server-Timing` header and to the `/metrics` endpoint, requests with
+    more than PERFORMANCE_QUERY_BUDGET queries are logged with the
+    repeated SQL.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_METRICS:
+            raise MiddlewareNotUsed
+        if not getattr(BaseSerializer.data.fget, 'timed', False):
+            BaseSerializer.data = time_serializer_data(BaseSerializer.data)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = request.performance_metrics = RequestMetrics()
+        _local.metrics = metrics
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(metrics.record_query):
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        duration = time.perf_counter() - started
+        queries = sum(metrics.queries.values())
+        size = 0 if response.streaming else len(response.content)
+        response['Server-Timing'] = (
+            f'db;dur={metrics.db * 1000:.1f};desc="{queries} queries", '
+            f'serialize;dur={metrics.serialize * 1000:.1f}, '
+            f'render;dur={metrics.render * 1000:.1f}, '
+            f'total;dur={duration * 1000:.1f}')
+        registry.observe(
+            metrics.view, response.status_code, duration, queries=queries,
+            db=metrics.db, serialize=metrics.serialize,
+            render=metrics.render, size=size)
+        if queries > settings.PERFORMANCE_QUERY_BUDGET:
+            self.warn(request, metrics, queries)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.performance_metrics.view = get_view_name(
+            view_func, request.method)
+
+    def process_template_response(self, request, response):
+        metrics = request.performance_metrics
+        started = time.perf_counter()
+
+        def rendered(response):
+            metrics.render += time.perf_counter() - started
+
+        response.add_post_render_callback(rendered)
+        return response
+
+    def warn(self, request, metrics, queries):
+        duplicated = [(count, sql) for sql, count
+                      in metrics.queries.most_common(5) if count > 1]
+        logger.warning(
+            '%s %s (%s) made %d queries, budget is %d. Repeated:\n%s',
+            request.method, request.path, metrics.view, queries,
+            settings.PERFORMANCE_QUERY_BUDGET,
+            '\n'.join(f'{count} x {sql}' for count, sql in duplicated))
@@ -0,0 +1,43 @@
+from django.utils.cache import (get_conditional_response, patch_cache_control,
+                                patch_vary_headers)
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """Answer conditional list/retrieve requests without serialization.
+
+    Views define `get_etag` and `get_last_modified` returning cheap
+    validators, and `cache_control` with `Cache-Control` directives.
+    """
+    cache_control = {'private': True, 'no_cache': True}
+
+    def get_etag(self, request):
+        return None
+
+    def get_last_modified(self, request):
+        return None
+
+    def conditional(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        etag = etag and quote_etag(etag)
+        last_modified = self.get_last_modified(request)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code not in (200, 304):
+            return response
+        if etag:
+            response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, **self.cache_control)
+        if self.cache_control.get('private'):
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
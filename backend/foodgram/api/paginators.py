@@ -1,5 +1,16 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
 from django.core import paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class CustomPaginator(PageNumberPagination):
@@ -7,3 +18,117 @@ class CustomPaginator(PageNumberPagination):
     django_paginator_class = paginator.Paginator
     page_query_param = 'page'
     page_size_query_param = 'limit'
+
+
+def estimate_count(queryset):
+    """Return planner estimate of queryset rows, PostgreSQL only."""
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class RecipePaginator(CustomPaginator):
+    """Recipe feed pagination with an opt-in keyset mode.
+
+    Passing `cursor` (empty for the first page) switches from page numbers
+    to keyset pagination on `(created, id)`, which neither skips rows with
+    OFFSET nor counts the whole feed. `count=exact` or `count=estimate`
+    adds the total count to a keyset page. Keyset pages follow the default
+    order only.
+    """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    cursor_mode = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.cursor_query_param in request.query_params
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+        if queryset.query.order_by:
+            raise ValidationError(
+                {self.cursor_query_param: 'Курсор нельзя сочетать с '
+                                          'сортировкой.'})
+        self.request = request
+        self.count = self.get_count(queryset, request)
+        position = self.decode_cursor(
+            request.query_params[self.cursor_query_param])
+        if position is not None:
+            created, pk = position
+            queryset = queryset.filter(
+                Q(created__lt=created) | Q(created=created, pk__lt=pk))
+        page_size = self.get_page_size(request)
+        page = list(queryset.order_by('-created', '-pk')[:page_size + 1])
+        self.next_position = None
+        if len(page) > page_size:
+            last = page[page_size - 1]
+            self.next_position = (last.created, last.pk)
+        return page[:page_size]
+
+    def paginate_positions(self, get_positions, request):
+        """Keyset page over `(created, id)` pairs, newest first.
+
+        `get_positions(position, limit)` returns up to `limit` pairs older
+        than `position`, or the newest ones when `position` is None.
+        """
+        self.cursor_mode = True
+        self.request = request
+        self.count = None
+        position = self.decode_cursor(
+            request.query_params.get(self.cursor_query_param, ''))
+        page_size = self.get_page_size(request)
+        page = get_positions(position, page_size + 1)
+        self.next_position = None
+        if len(page) > page_size:
+            self.next_position = page[page_size - 1]
+        return page[:page_size]
+
+    def get_count(self, queryset, request):
+        count = request.query_params.get(self.count_query_param)
+        if count == 'exact':
+            return queryset.count()
+        if count == 'estimate':
+            return estimate_count(queryset)
+        return None
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            created, pk = base64.urlsafe_b64decode(
+                cursor.encode()).decode().split('|')
+            created = parse_datetime(created)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            created = None
+        if created is None:
+            raise NotFound('Неверный курсор.')
+        return created, pk
+
+    def encode_cursor(self, position):
+        created, pk = position
+        return base64.urlsafe_b64encode(
+            f'{created.isoformat()}|{pk}'.encode()).decode()
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
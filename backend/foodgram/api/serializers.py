@@ -1,12 +1,19 @@
-import base64
-
-from django.core.files.base import ContentFile
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 from rest_framework.validators import UniqueTogetherValidator
 
+from api.viewer import ViewerStateMixin
+from recipes.cache import invalidate_cart
+from recipes.counters import change_counter
+from recipes.images import (RENDITIONS, decode_base64, rendition_names,
+                            schedule_renditions)
 from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.timeline import fan_out
 from users.models import User
 
 
@@ -18,7 +25,7 @@ class CustomUserCreateSerializer(UserCreateSerializer):
                   'password')
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(ViewerStateMixin, UserSerializer):
     """Serializer to work with custom User model."""
     is_subscribed = serializers.SerializerMethodField()
 
@@ -28,11 +35,7 @@ class CustomUserSerializer(UserSerializer):
                   'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        if self.context['request'].user.is_authenticated:
-            user = get_object_or_404(
-                User, username=self.context['request'].user)
-            return user.follower.filter(author=obj.id).exists()
-        return False
+        return obj.id in self.viewer.subscriptions
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -56,11 +59,71 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('__all__')
 
 
+def does_not_exist(pk):
+    return serializers.PrimaryKeyRelatedField.default_error_messages[
+        'does_not_exist'].format(pk_value=pk)
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Resolves all primary keys of the list with a single query."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        pks = [self.child_relation.to_pk(item) for item in data]
+        objects = self.child_relation.get_queryset().in_bulk(pks)
+        missing = [does_not_exist(pk) for pk in pks if pk not in objects]
+        if missing:
+            raise serializers.ValidationError(missing)
+        return [objects[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field which resolves `many=True` lists in bulk."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_pk(self, data):
+        """Convert a list item to an integer primary key.
+
+        Booleans and fractional numbers are rejected, as IntegerField does.
+        """
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        try:
+            return int(serializers.IntegerField.re_decimal.sub('', str(data)))
+        except ValueError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class IngredientRecipeListSerializer(serializers.ListSerializer):
+    """Resolves ingredients of all list items with a single query."""
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = Ingredient.objects.in_bulk(
+            {item['ingredient']['id'] for item in items})
+        errors = [
+            {} if item['ingredient']['id'] in ingredients
+            else {'id': [does_not_exist(item['ingredient']['id'])]}
+            for item in items]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        for item in items:
+            item['ingredient']['id'] = ingredients[item['ingredient']['id']]
+        return items
+
+
 class IngredientRecipeSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-        source='ingredient.id'
-    )
+    id = serializers.IntegerField(source='ingredient.id')
     name = serializers.CharField(source='ingredient.name', read_only=True)
     measurement_unit = serializers.CharField(
         source='ingredient.measurement_unit', read_only=True)
@@ -68,6 +131,7 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = IngredientRecipe
         fields = ('id', 'name', 'measurement_unit', 'amount')
+        list_serializer_class = IngredientRecipeListSerializer
         extra_kwargs = {
             'amount': {
                 'min_value': None,
@@ -76,16 +140,58 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
 
 
 class Base64ImageField(serializers.ImageField):
+    default_error_messages = {
+        'max_size': 'Размер картинки не должен превышать {max_size} байт.',
+        'max_dimension': ('Стороны картинки не должны превышать '
+                          '{max_dimension} пикселей.'),
+    }
+
     def to_internal_value(self, data):
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-
-        return super().to_internal_value(data)
-
-
-class RecipeSerializer(serializers.ModelSerializer):
+            if len(imgstr) * 3 // 4 > max_size:
+                self.fail('max_size', max_size=max_size)
+            try:
+                data = decode_base64(imgstr, 'temp.' + ext)
+            except ValueError:
+                self.fail('invalid_image')
+
+        image = super().to_internal_value(data)
+        if image.size > max_size:
+            self.fail('max_size', max_size=max_size)
+        max_dimension = settings.RECIPE_IMAGE_MAX_DIMENSION
+        if max(image.image.size) > max_dimension:
+            self.fail('max_dimension', max_dimension=max_dimension)
+        return image
+
+
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """URLs of resized copies of the recipe image.
+
+    Until the copies are rendered every URL points to the original image.
+    """
+
+    def __init__(self, renditions=tuple(RENDITIONS), **kwargs):
+        self.renditions = renditions
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        request = self.context.get('request')
+        urls = {}
+        names = rendition_names(recipe.image.name, self.renditions)
+        for key, name in names.items():
+            url = (default_storage.url(name) if recipe.has_renditions
+                   else recipe.image.url)
+            urls[key] = request.build_absolute_uri(url) if request else url
+        return urls
+
+
+class RecipeSerializer(ViewerStateMixin, serializers.ModelSerializer):
     """Serializer to work with Recipe list/retrieve."""
     tags = TagSerializer(read_only=True, many=True)
     ingredients = IngredientRecipeSerializer(many=True,
@@ -93,40 +199,32 @@ class RecipeSerializer(serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True,
                                   default=serializers.CurrentUserDefault())
     image = Base64ImageField()
+    image_renditions = ImageRenditionsField(renditions=('medium',))
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image',
+                  'image_renditions', 'text', 'cooking_time')
 
     def get_is_favorited(self, obj):
-        if self.context['request'].user.is_authenticated:
-            user = get_object_or_404(
-                User, username=self.context['request'].user)
-            return user.favorite.filter(recipe=obj.id).exists()
-        return False
+        return obj.id in self.viewer.favorites
 
     def get_is_in_shopping_cart(self, obj):
-        if self.context['request'].user.is_authenticated:
-            user = get_object_or_404(
-                User, username=self.context['request'].user)
-            return user.cart.filter(recipe=obj.id).exists()
-        return False
+        return obj.id in self.viewer.cart
 
 
 class RecipeCreateSerializer(RecipeSerializer):
     """Serializer to work with Recipe create."""
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
+    tags = BulkPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
-                  'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image',
+                  'image_renditions', 'text', 'cooking_time')
         extra_kwargs = {
             'cooking_time': {
                 'min_value': None,
@@ -140,6 +238,12 @@ class RecipeCreateSerializer(RecipeSerializer):
             )
         ]
 
+    def to_representation(self, instance):
+        prefetch_related_objects([instance], Prefetch(
+            'recipe_ingredients',
+            queryset=IngredientRecipe.objects.select_related('ingredient')))
+        return super().to_representation(instance)
+
     @staticmethod
     def save_ingredients(recipe, ingredients):
         ingredients_list = []
@@ -153,6 +257,41 @@ class RecipeCreateSerializer(RecipeSerializer):
                     amount=current_amount))
         IngredientRecipe.objects.bulk_create(ingredients_list)
 
+    @staticmethod
+    def update_tags(recipe, tags):
+        current = set(recipe.tags.values_list('id', flat=True))
+        new = {tag.id for tag in tags}
+        recipe.tags.remove(*(current - new))
+        recipe.tags.add(*(new - current))
+
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """Write only the difference between stored and new ingredients.
+
+        Returns True if anything has changed.
+        """
+        current = {item.ingredient_id: item
+                   for item in recipe.recipe_ingredients.all()}
+        amounts = {ingredient['ingredient']['id'].id: ingredient['amount']
+                   for ingredient in ingredients}
+        to_delete = [item.id for ingredient_id, item in current.items()
+                     if ingredient_id not in amounts]
+        to_update = []
+        for ingredient_id, item in current.items():
+            if amounts.get(ingredient_id, item.amount) != item.amount:
+                item.amount = amounts[ingredient_id]
+                to_update.append(item)
+        to_create = [
+            IngredientRecipe(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current]
+        if to_delete:
+            IngredientRecipe.objects.filter(id__in=to_delete).delete()
+        IngredientRecipe.objects.bulk_update(to_update, ['amount'])
+        IngredientRecipe.objects.bulk_create(to_create)
+        return bool(to_delete or to_update or to_create)
+
     def validate(self, data):
         if data['cooking_time'] <= 0:
             raise serializers.ValidationError('Время приготовления не может '
@@ -170,6 +309,7 @@ class RecipeCreateSerializer(RecipeSerializer):
                                               ' повторяться.')
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         author = self.context['request'].user
         ingredients = validated_data.pop('recipe_ingredients')
@@ -177,39 +317,79 @@ class RecipeCreateSerializer(RecipeSerializer):
         recipe = Recipe.objects.create(**validated_data, author=author)
         recipe.tags.add(*tags)
         self.save_ingredients(recipe, ingredients)
+        change_counter(User, author.id, 'recipes_count')
+        transaction.on_commit(lambda: schedule_renditions(recipe))
+        transaction.on_commit(lambda: fan_out(recipe))
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         instance.name = validated_data.get('name', instance.name)
         instance.text = validated_data.get('text', instance.text)
-        instance.image = validated_data.get('image', instance.image)
+        if 'image' in validated_data:
+            instance.image = validated_data['image']
+            instance.has_renditions = False
+            transaction.on_commit(lambda: schedule_renditions(instance))
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time)
         ingredients = validated_data.pop('recipe_ingredients')
         tags = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.add(*tags)
-        instance.ingredients.clear()
-        recipe = instance
-        self.save_ingredients(recipe, ingredients)
+        self.update_tags(instance, tags)
+        if self.update_ingredients(instance, ingredients):
+            users = list(instance.cart.values_list('user_id', flat=True))
+            transaction.on_commit(lambda: invalidate_cart(*users))
         instance.save()
         return instance
 
 
 class MiniRecipeSerializer(RecipeSerializer):
     """Serializer to work with MiniRecipe."""
+    image_renditions = ImageRenditionsField(renditions=('thumbnail',))
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'cooking_time', 'image')
+        fields = ('id', 'name', 'cooking_time', 'image', 'image_renditions')
+
+
+class CookableRecipeSerializer(RecipeSerializer):
+    """Recipe found by ingredients with the number of them matched."""
+    matched_ingredients = serializers.IntegerField(read_only=True)
+    missing_ingredients = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + (
+            'matched_ingredients', 'missing_ingredients')
 
 
 class SubscriptionSerializer(CustomUserSerializer):
     """Serializer to work with Subscription model."""
-    recipes = MiniRecipeSerializer(read_only=True, many=True)
-    recipes_count = serializers.IntegerField(source='recipes.count',
-                                             read_only=True)
+    recipes = MiniRecipeSerializer(source='limited_recipes', read_only=True,
+                                   many=True)
 
     class Meta:
         model = User
         fields = ('id', 'email', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count')
+
+
+class BulkActionSerializer(serializers.Serializer):
+    """List of recipe or author ids for bulk actions."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False)
+
+    def validate_ids(self, value):
+        max_batch = settings.BULK_ACTIONS_MAX_BATCH
+        if len(value) > max_batch:
+            raise serializers.ValidationError(
+                f'Не больше {max_batch} объектов за один запрос.')
+        return list(dict.fromkeys(value))
+
+
+class IngredientsQuerySerializer(serializers.Serializer):
+    """Ingredients at hand and number of recipes to find."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False,
+        max_length=settings.RECIPE_SEARCH_MAX_INGREDIENTS)
+    limit = serializers.IntegerField(
+        min_value=1, max_value=settings.RECIPE_SEARCH_MAX_RESULTS,
+        default=settings.REST_FRAMEWORK['PAGE_SIZE'])
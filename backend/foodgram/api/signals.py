@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from api.authentication import token_cache
+from users.models import User
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_changed(instance, created, **kwargs):
+    # Cached users would keep an old `is_active` flag or password hash.
+    if not created:
+        token_cache.delete(*Token.objects.filter(
+            user=instance).values_list('key', flat=True))
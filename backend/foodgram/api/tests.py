@@ -0,0 +1,581 @@
+import io
+import re
+import shutil
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from rest_framework.test import APIClient, APITestCase
+
+from api.authentication import _cache_key, token_cache
+from api.filters import RecipeFilter
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag, TimelineEntry)
+from recipes.pantry import RecipeIngredientIndex
+from recipes.timeline import fan_out
+from users.models import Subscription, User
+
+IMAGE = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABiey'
+         'waAAAACVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklE'
+         'QVQImWNoAAAAggCByxOyYQAAAABJRU5ErkJggg==')
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com', password='pw',
+        first_name='Имя', last_name='Фамилия')
+
+
+class RecipesTestCase(APITestCase):
+    """Users, tags, ingredients and recipes shared by API tests."""
+    recipes_count = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [create_user(f'user{number}') for number in range(3)]
+        cls.tags = [Tag.objects.create(name=f'Тег {number}', color='#fff',
+                                       slug=f'tag{number}')
+                    for number in range(3)]
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(60))
+        cls.ingredients = list(Ingredient.objects.order_by('pk'))
+        cls.recipes = []
+        for number in range(cls.recipes_count):
+            recipe = Recipe.objects.create(
+                author=cls.users[number % 3], name=f'Рецепт {number}',
+                image='recipes/image.png', text='Текст', cooking_time=5)
+            recipe.tags.set([cls.tags[number % 3],
+                             cls.tags[(number + 1) % 3]])
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, amount=amount,
+                                 ingredient=cls.ingredients[number + amount])
+                for amount in range(1, 4))
+            cls.recipes.append(recipe)
+        user, author = cls.users[:2]
+        Favorite.objects.create(user=user, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=user, recipe=cls.recipes[1])
+        Subscription.objects.create(user=user, author=author)
+
+    def setUp(self):
+        cache.clear()
+
+
+class RecipeListQueriesTest(RecipesTestCase):
+    """The recipe feed costs the same number of queries for any page."""
+
+    def assert_page_queries(self, number):
+        for limit in (2, self.recipes_count):
+            with self.subTest(limit=limit), self.assertNumQueries(number):
+                response = self.client.get('/api/recipes/', {'limit': limit})
+                self.assertEqual(len(response.data['results']), limit)
+
+    def test_anonymous(self):
+        self.assert_page_queries(4)
+
+    def test_authenticated(self):
+        self.client.force_authenticate(self.users[0])
+        # Plus the viewer's subscriptions, favorites and cart id sets.
+        self.assert_page_queries(7)
+
+    def test_flags(self):
+        self.client.force_authenticate(self.users[0])
+        response = self.client.get('/api/recipes/', {'limit': 12})
+        flags = {recipe['id']: (recipe['is_favorited'],
+                                recipe['is_in_shopping_cart'])
+                 for recipe in response.data['results']}
+        self.assertEqual(flags[self.recipes[0].pk], (True, False))
+        self.assertEqual(flags[self.recipes[1].pk], (False, True))
+        self.assertEqual(flags[self.recipes[2].pk], (False, False))
+
+
+class RecipeFilterTest(RecipesTestCase):
+    """Every filter combination is exact, cheap and served by indexes."""
+    # (query params, recipe number predicate, queries). Authors are given
+    # by index in `users`, filters by tag and author look them up first.
+    combinations = (
+        ({}, lambda number: True, 7),
+        ({'tags': ['tag0']}, lambda number: number % 3 in (0, 2), 8),
+        ({'tags': ['tag0', 'tag1']}, lambda number: True, 8),
+        ({'author': 1}, lambda number: number % 3 == 1, 8),
+        ({'is_favorited': 1}, lambda number: number == 0, 7),
+        ({'is_favorited': 0, 'author': 0},
+         lambda number: number % 3 == 0, 8),
+        ({'is_in_shopping_cart': 1}, lambda number: number == 1, 7),
+        ({'is_in_shopping_cart': 0, 'tags': ['tag2']},
+         lambda number: number % 3 in (1, 2), 8),
+        ({'is_favorited': 1, 'is_in_shopping_cart': 1},
+         lambda number: False, 1),
+        ({'tags': ['tag1'], 'author': 1, 'is_in_shopping_cart': 1},
+         lambda number: number == 1, 9),
+    )
+    # Tables or aliases read in full: (PostgreSQL, SQLite) plan lines.
+    scan = re.compile(r'(?:Seq Scan on|^.*\bSCAN) "?(\w+)', re.MULTILINE)
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.users[0])
+
+    def get_scanned(self, params):
+        queryset = RecipeFilter(
+            params, queryset=Recipe.objects.all(),
+            request=SimpleNamespace(user=self.users[0])).qs
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would be read in full even with indexes.
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return set(self.scan.findall(queryset.explain()))
+
+    def test_combinations(self):
+        for params, predicate, queries in self.combinations:
+            if 'author' in params:
+                params = dict(params, author=self.users[params['author']].pk)
+            expected = {recipe.pk for number, recipe
+                        in enumerate(self.recipes) if predicate(number)}
+            with self.subTest(**params):
+                with self.assertNumQueries(queries):
+                    response = self.client.get(
+                        '/api/recipes/', dict(params, limit=20))
+                ids = [recipe['id'] for recipe in response.data['results']]
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertEqual(set(ids), expected)
+                scanned = self.get_scanned(params)
+                if 'author' in params:
+                    self.assertEqual(scanned, set())
+                else:
+                    self.assertLessEqual(scanned, {'recipes_recipe'})
+
+
+class RecipeCreateTest(RecipesTestCase):
+    """Creating a recipe costs the same queries for any ingredient count."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media)
+        cls.media_settings.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.users[0])
+
+    def create(self, name, ingredients, tags):
+        return self.client.post('/api/recipes/', {
+            'name': name, 'text': 'Текст', 'cooking_time': 10,
+            'image': IMAGE, 'tags': tags,
+            'ingredients': [{'id': ingredient, 'amount': 1}
+                            for ingredient in ingredients]}, format='json')
+
+    def test_queries(self):
+        tags = [tag.pk for tag in self.tags]
+        for count in (5, 50):
+            ingredients = [ingredient.pk
+                           for ingredient in self.ingredients[:count]]
+            with self.subTest(ingredients=count), self.assertNumQueries(16):
+                response = self.create(f'Новый {count}', ingredients, tags)
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(len(response.data['ingredients']), count)
+
+    def test_invalid_ids(self):
+        missing = self.ingredients[-1].pk + 1
+        response = self.create(
+            'Новый', [self.ingredients[0].pk, missing, missing + 1],
+            [self.tags[0].pk])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            [bool(error) for error in response.data['ingredients']],
+            [False, True, True])
+        for tag, data_type in ((True, 'bool'), (1.9, 'float'),
+                               (None, 'NoneType')):
+            with self.subTest(tag=tag):
+                response = self.create('Новый', [self.ingredients[0].pk],
+                                       [self.tags[0].pk, tag])
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(data_type, response.data['tags'][0])
+
+
+class ToggleConcurrencyTest(TransactionTestCase):
+    """Concurrent toggles of the same relation add or remove it once."""
+    threads = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('threads need a database file or server')
+        cache.clear()
+        self.author, self.user = create_user('author'), create_user('user')
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', image='recipes/image.png',
+            text='Текст', cooking_time=5)
+
+    def run_threads(self, method, url):
+        """Send the request from all threads at once, return statuses."""
+        barrier = threading.Barrier(self.threads)
+        statuses = []
+
+        def send():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            barrier.wait()
+            try:
+                statuses.append(getattr(client, method)(url).status_code)
+            except Exception:
+                # The test client raises what the server would answer
+                # with 500, e.g. IntegrityError.
+                statuses.append(500)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=send)
+                   for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(statuses)
+
+    def test_toggles(self):
+        toggles = (
+            (f'/api/recipes/{self.recipe.pk}/favorite/', Favorite,
+             self.recipe, 'favorites_count'),
+            (f'/api/recipes/{self.recipe.pk}/shopping_cart/', ShoppingCart,
+             self.recipe, 'carts_count'),
+            (f'/api/users/{self.author.pk}/subscribe/', Subscription,
+             self.author, 'followers_count'),
+        )
+        rejected = [400] * (self.threads - 1)
+        for url, model, target, counter in toggles:
+            rows = model.objects.filter(user=self.user)
+            for _ in range(2):
+                with self.subTest(url=url, method='post'):
+                    self.assertEqual(self.run_threads('post', url),
+                                     [201] + rejected)
+                    self.assertEqual(rows.count(), 1)
+                    target.refresh_from_db()
+                    self.assertEqual(getattr(target, counter), 1)
+                with self.subTest(url=url, method='delete'):
+                    self.assertEqual(self.run_threads('delete', url),
+                                     [204] + rejected)
+                    self.assertEqual(rows.count(), 0)
+                    target.refresh_from_db()
+                    self.assertEqual(getattr(target, counter), 0)
+
+
+class RecipeSearchTest(RecipesTestCase):
+    """Search by ingredients at hand never returns deleted recipes."""
+
+    def setUp(self):
+        super().setUp()
+        self.index = RecipeIngredientIndex()
+        patcher = mock.patch('api.views.recipe_ingredient_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Ingredients unused by the shared recipes, the first one matches
+        # all of the new recipes, the best coverage first.
+        self.pantry = self.ingredients[-3:]
+        self.found = []
+        for count in range(1, 4):
+            recipe = Recipe.objects.create(
+                author=self.users[0], name=f'Из запасов {count}',
+                image='recipes/image.png', text='Текст', cooking_time=5)
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in self.pantry[:count])
+            self.found.append(recipe.pk)
+
+    def search(self, limit):
+        response = self.client.get('/api/recipes/by_ingredients/', {
+            'ingredients': [self.pantry[0].pk], 'limit': limit})
+        return [recipe['id'] for recipe in response.data]
+
+    def test_search(self):
+        self.assertEqual(self.search(3), self.found)
+
+    def test_deleted(self):
+        self.assertEqual(self.search(1), self.found[:1])
+        Recipe.objects.filter(pk__in=self.found[:2]).delete()
+        self.assertEqual(self.search(1), self.found[2:])
+
+    def test_discard(self):
+        self.index.search([self.pantry[0].pk], 3)
+        self.index.discard(self.found[:1])
+        self.assertEqual(
+            self.index.search([self.pantry[0].pk], 3),
+            [(self.found[1], 1, 2), (self.found[2], 1, 3)])
+
+
+class BulkActionTest(RecipesTestCase):
+    """Bulk actions report the outcome for every id once."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.users[0])
+
+    def send(self, method, url, ids):
+        response = getattr(self.client, method)(url, {'ids': ids},
+                                                format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return [(item['id'], item['status']) for item in response.data]
+
+    def test_favorite(self):
+        first, second, third = (recipe.pk for recipe in self.recipes[:3])
+        missing = self.recipes[-1].pk + 1
+        self.assertEqual(
+            self.send('post', '/api/recipes/favorite/',
+                      [second, first, second, missing, third]),
+            [(second, 201), (first, 400), (missing, 404), (third, 201)])
+        favorites = Favorite.objects.filter(user=self.users[0])
+        self.assertEqual(favorites.count(), 3)
+        self.assertEqual(
+            Recipe.objects.get(pk=second).favorites_count, 1)
+        self.assertEqual(
+            self.send('delete', '/api/recipes/favorite/',
+                      [second, second, self.recipes[3].pk]),
+            [(second, 204), (self.recipes[3].pk, 400)])
+        self.assertEqual(favorites.count(), 2)
+        self.assertEqual(
+            Recipe.objects.get(pk=second).favorites_count, 0)
+
+    def test_subscribe(self):
+        user, author, other = self.users
+        self.assertEqual(
+            self.send('post', '/api/users/subscribe/',
+                      [user.pk, author.pk, other.pk, other.pk]),
+            [(user.pk, 400), (author.pk, 400), (other.pk, 201)])
+        self.assertEqual(
+            set(user.follower.values_list('author', flat=True)),
+            {author.pk, other.pk})
+
+
+class RecipeConditionalGetTest(RecipesTestCase):
+    """A recipe is not sent again until anything it shows changes."""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.users[0])
+        self.recipe = self.recipes[2]
+        self.url = f'/api/recipes/{self.recipe.pk}/'
+
+    def test_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.client.force_authenticate(None)
+        response = self.client.get(self.url)
+        response = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_invalidation(self):
+        author = self.recipe.author
+
+        def rename_author():
+            author.first_name = 'Другое'
+            author.save()
+
+        changes = {
+            'recipe': lambda: Recipe.objects.get(pk=self.recipe.pk).save(),
+            'author': rename_author,
+            'favorite': lambda: self.client.post(f'{self.url}favorite/'),
+            'cart': lambda: self.client.post(f'{self.url}shopping_cart/'),
+            'subscription': lambda: self.client.post(
+                f'/api/users/{author.pk}/subscribe/'),
+            'tag': lambda: self.tags[0].save(),
+            'ingredient': lambda: self.ingredients[0].save(),
+        }
+        for name, change in changes.items():
+            with self.subTest(change=name):
+                etag = self.client.get(self.url)['ETag']
+                change()
+                response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+
+
+class RecipeCursorTest(RecipesTestCase):
+    """Keyset pages list every recipe once, in the default order."""
+
+    def test_pages(self):
+        # Recipes created at the same moment are ordered by id.
+        Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in self.recipes[3:9]]).update(
+                created=self.recipes[0].created)
+        expected = list(Recipe.objects.order_by(
+            '-created', '-pk').values_list('pk', flat=True))
+        ids, pages = [], 0
+        url, params = '/api/recipes/', {'cursor': '', 'limit': 5}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.data['count'])
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url, params = response.data['next'], None
+            pages += 1
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+    def test_count(self):
+        response = self.client.get(
+            '/api/recipes/', {'cursor': '', 'count': 'exact', 'limit': 5})
+        self.assertEqual(response.data['count'], self.recipes_count)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/', {'cursor': 'абв'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CounterTest(RecipesTestCase):
+    """Counters follow toggles and deletions of the rows they count."""
+
+    def setUp(self):
+        super().setUp()
+        # Shared rows are created without touching counters.
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.client.force_authenticate(self.users[0])
+
+    def assert_counter(self, obj, field, value):
+        obj.refresh_from_db()
+        self.assertEqual(getattr(obj, field), value)
+
+    def test_toggles(self):
+        recipe, author = self.recipes[5], self.users[2]
+        toggles = (
+            (f'/api/recipes/{recipe.pk}/favorite/', recipe,
+             'favorites_count'),
+            (f'/api/recipes/{recipe.pk}/shopping_cart/', recipe,
+             'carts_count'),
+            (f'/api/users/{author.pk}/subscribe/', author,
+             'followers_count'),
+        )
+        for url, target, field in toggles:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.post(url).status_code, 201)
+                self.assert_counter(target, field, 1)
+                self.assertEqual(self.client.post(url).status_code, 400)
+                self.assert_counter(target, field, 1)
+                self.assertEqual(self.client.delete(url).status_code, 204)
+                self.assert_counter(target, field, 0)
+                self.assertEqual(self.client.delete(url).status_code, 400)
+                self.assert_counter(target, field, 0)
+
+    def test_drifted(self):
+        recipe = self.recipes[0]
+        Recipe.objects.filter(pk=recipe.pk).update(favorites_count=0)
+        response = self.client.delete(f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_counter(recipe, 'favorites_count', 0)
+
+    def test_recipe_deleted(self):
+        author = self.users[0]
+        self.assert_counter(author, 'recipes_count', 4)
+        response = self.client.delete(f'/api/recipes/{self.recipes[3].pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_counter(author, 'recipes_count', 3)
+        Recipe.objects.filter(pk=self.recipes[6].pk).delete()
+        call_command('reconcile_counters', stdout=io.StringIO())
+        self.assert_counter(author, 'recipes_count', 2)
+
+
+class TokenCacheTest(RecipesTestCase):
+    """Cached tokens stop working as soon as they are revoked."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.get(pk=self.users[0].pk)
+        response = self.client.post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': 'pw'})
+        self.key = response.data['auth_token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+
+    def get_me(self):
+        return self.client.get('/api/users/me/')
+
+    def test_cached(self):
+        self.assertEqual(self.get_me().status_code, 200)
+        hits = token_cache.get_stats()['local_hits']
+        response = self.get_me()
+        self.assertEqual(response.data['username'], self.user.username)
+        self.assertEqual(token_cache.get_stats()['local_hits'], hits + 1)
+        # The shared cache never sees the user row itself.
+        self.assertEqual(cache.get(_cache_key(self.key)),
+                         (self.user.pk, True))
+
+    def test_logout(self):
+        self.get_me()
+        response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_me().status_code, 401)
+        self.assertIsNone(cache.get(_cache_key(self.key)))
+
+    def test_deactivated(self):
+        self.get_me()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_me().status_code, 401)
+
+
+class FeedTest(RecipesTestCase):
+    """The feed lists recipes of followed authors, newest first."""
+
+    def setUp(self):
+        super().setUp()
+        self.first, self.second, self.user = self.users
+        self.client.force_authenticate(self.user)
+        for author in (self.first, self.second):
+            response = self.client.post(f'/api/users/{author.pk}/subscribe/')
+            self.assertEqual(response.status_code, 201)
+
+    def get_feed(self):
+        response = self.client.get('/api/recipes/feed/', {'limit': 20})
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def get_recipes(self, *authors):
+        return list(Recipe.objects.filter(author__in=authors).order_by(
+            '-created', '-pk').values_list('pk', flat=True))
+
+    def create_recipe(self, author):
+        recipe = Recipe.objects.create(
+            author=author, name=f'Новый {Recipe.objects.count()}',
+            image='recipes/image.png', text='Текст', cooking_time=5)
+        # Called on commit by the serializer.
+        fan_out(recipe)
+        return recipe
+
+    def test_follow(self):
+        self.assertEqual(self.get_feed(),
+                         self.get_recipes(self.first, self.second))
+
+    def test_fan_out(self):
+        recipe = self.create_recipe(self.second)
+        self.create_recipe(self.user)
+        feed = self.get_feed()
+        self.assertEqual(feed[0], recipe.pk)
+        self.assertEqual(feed, self.get_recipes(self.first, self.second))
+
+    def test_unfollow(self):
+        response = self.client.delete(f'/api/users/{self.first.pk}/subscribe/')
+        self.assertEqual(response.status_code, 204)
+        self.create_recipe(self.first)
+        self.assertEqual(self.get_feed(), self.get_recipes(self.second))
+
+    @override_settings(TIMELINE_LENGTH=3)
+    def test_trim(self):
+        recipes = [self.create_recipe(self.first).pk for _ in range(2)]
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(self.get_feed()[:2], recipes[::-1])
@@ -1,61 +1,150 @@
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
-from rest_framework import serializers
+from django.db import connection, transaction
+from rest_framework import exceptions, serializers, status
 
+from recipes.cache import invalidate_cart
+from recipes.counters import change_counter, recount
 from recipes.models import Favorite, ShoppingCart
+from recipes.timeline import follow, unfollow
 from users.models import Subscription
 
-
-def get_cart_txt(ingredients):
-    """Function to generate txt file for shopping list."""
-    content_list = []
-    for ingredient in ingredients:
-        content_list.append(
-            f'{ingredient["ingredient__name"]} '
-            f'({ingredient["ingredient__measurement_unit"]}): '
-            f'{ingredient["total_amount"]}')
-    content = 'Ваш список покупок:\n\n' + '\n'.join(content_list)
-    filename = 'shopping_cart.txt'
-    file = HttpResponse(content, content_type='text/plain')
-    file['Content-Disposition'] = 'attachment; filename={0}'.format(
-        filename)
-    return file
-
-
 MODELS = {
     Subscription: {
         'name': 'author',
+        'counter': 'followers_count',
         'err_exist': 'Вы уже подписаны на этого пользователя!',
         'err_not_exist': 'Вы не подписаны на этого пользователя!',
+        'err_self': 'Нельзя подписаться на самого себя!',
     },
     Favorite: {
         'name': 'recipe',
+        'counter': 'favorites_count',
         'err_exist': 'Этот рецепт уже в избранном!',
         'err_not_exist': 'Этого рецепта нет в избранном!',
     },
     ShoppingCart: {
         'name': 'recipe',
+        'counter': 'carts_count',
         'err_exist': 'Этот рецепт уже в корзине!',
         'err_not_exist': 'Этого рецепта нет в корзине!',
     },
 }
 
 
+def insert_ignore(obj):
+    """Insert the object row unless it breaks a unique constraint.
+
+    Runs a single `INSERT ... ON CONFLICT DO NOTHING` (or the backend
+    equivalent) and returns True if the row has been inserted.
+    """
+    model = type(obj)
+    fields = [field for field in model._meta.local_concrete_fields
+              if field is not model._meta.auto_field]
+    ops = connection.ops
+    sql = '{insert} {table} ({columns}) VALUES ({values}) {suffix}'.format(
+        insert=ops.insert_statement(ignore_conflicts=True),
+        table=ops.quote_name(model._meta.db_table),
+        columns=', '.join(ops.quote_name(field.column) for field in fields),
+        values=', '.join(['%s'] * len(fields)),
+        suffix=ops.ignore_conflicts_suffix_sql(ignore_conflicts=True))
+    params = [field.get_db_prep_save(field.pre_save(obj, True), connection)
+              for field in fields]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount == 1
+
+
 def post_for_actions(user, obj, model):
     """Function for post request actions."""
-    args = {MODELS[model]['name']: obj,
-            'user': user}
-    post_obj = model(**args)
-    if model.objects.filter(**args).exists():
-        raise serializers.ValidationError(MODELS[model]['err_exist'])
-    post_obj.save()
-
-
-def delete_for_actions(user, obj, model):
-    """Function for delete request actions."""
-    args = {MODELS[model]['name']: obj,
-            'user': user}
-    if not model.objects.filter(**args).exists():
-        raise serializers.ValidationError(MODELS[model]['err_not_exist'])
-    del_obj = get_object_or_404(model, **args)
-    del_obj.delete()
+    config = MODELS[model]
+    with transaction.atomic():
+        if not insert_ignore(model(user=user, **{config['name']: obj})):
+            raise serializers.ValidationError(config['err_exist'])
+        change_counter(type(obj), obj.pk, config['counter'])
+    if model is ShoppingCart:
+        invalidate_cart(user.id)
+    if model is Subscription:
+        follow(user.id, [obj.pk])
+
+
+def delete_for_actions(user, pk, model):
+    """Function for delete request actions, does not load the target."""
+    config = MODELS[model]
+    with transaction.atomic():
+        deleted, _ = model.objects.filter(
+            user=user, **{config['name']: pk}).delete()
+        if not deleted:
+            raise serializers.ValidationError(config['err_not_exist'])
+        change_counter(model._meta.get_field(config['name']).related_model,
+                       pk, config['counter'], -1)
+    if model is ShoppingCart:
+        invalidate_cart(user.id)
+    if model is Subscription:
+        unfollow(user.id, [pk])
+
+
+def get_statuses(ids, done, done_status, errors):
+    """Build per-item result: status code and error message if any."""
+    statuses = []
+    for pk in ids:
+        if pk in done:
+            statuses.append({'id': pk, 'status': done_status})
+        else:
+            code, detail = errors(pk)
+            statuses.append({'id': pk, 'status': code, 'detail': detail})
+    return statuses
+
+
+def bulk_post_for_actions(user, ids, model):
+    """Add many objects in one transaction, return status of every id."""
+    config = MODELS[model]
+    name = config['name']
+    target = model._meta.get_field(name).related_model
+    rows = model.objects.filter(user=user)
+    with transaction.atomic():
+        # Locked targets can't get rows from concurrent requests, so rows
+        # which appear after the insert are the inserted ones.
+        found = set(target.objects.select_for_update().filter(
+            pk__in=ids).order_by('pk').values_list('pk', flat=True))
+        existing = set(rows.filter(**{f'{name}__in': found}).values_list(
+            name, flat=True))
+        forbidden = {user.id} if 'err_self' in config else set()
+        model.objects.bulk_create(
+            [model(user=user, **{f'{name}_id': pk})
+             for pk in found - existing - forbidden],
+            ignore_conflicts=True)
+        new = set(rows.filter(**{f'{name}__in': found}).values_list(
+            name, flat=True)) - existing
+        recount(target, config['counter'], model, name, new)
+    if new and model is ShoppingCart:
+        invalidate_cart(user.id)
+    if new and model is Subscription:
+        follow(user.id, new)
+
+    def errors(pk):
+        if pk not in found:
+            return (status.HTTP_404_NOT_FOUND,
+                    exceptions.NotFound.default_detail)
+        if pk in forbidden:
+            return status.HTTP_400_BAD_REQUEST, config['err_self']
+        return status.HTTP_400_BAD_REQUEST, config['err_exist']
+
+    return get_statuses(ids, new, status.HTTP_201_CREATED, errors)
+
+
+def bulk_delete_for_actions(user, ids, model):
+    """Remove many objects with one DELETE, return status of every id."""
+    config = MODELS[model]
+    name = config['name']
+    with transaction.atomic():
+        present = set(model.objects.filter(
+            user=user, **{f'{name}__in': ids}).values_list(name, flat=True))
+        model.objects.filter(user=user, **{f'{name}__in': present}).delete()
+        recount(model._meta.get_field(name).related_model,
+                config['counter'], model, name, present)
+    if present and model is ShoppingCart:
+        invalidate_cart(user.id)
+    if present and model is Subscription:
+        unfollow(user.id, present)
+    return get_statuses(
+        ids, present, status.HTTP_204_NO_CONTENT,
+        lambda pk: (status.HTTP_400_BAD_REQUEST, config['err_not_exist']))
@@ -0,0 +1,41 @@
+from django.utils.functional import cached_property
+
+
+class ViewerState:
+    """Ids of recipes and authors related to the requesting user.
+
+    Each set is loaded with one query the first time it is needed and is
+    then shared by every serializer working within the same request.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def _ids(self, related_name, field):
+        if not self.user.is_authenticated:
+            return frozenset()
+        queryset = getattr(self.user, related_name)
+        return frozenset(queryset.values_list(field, flat=True))
+
+    @cached_property
+    def favorites(self):
+        return self._ids('favorite', 'recipe_id')
+
+    @cached_property
+    def cart(self):
+        return self._ids('cart', 'recipe_id')
+
+    @cached_property
+    def subscriptions(self):
+        return self._ids('follower', 'author_id')
+
+
+class ViewerStateMixin:
+    """Serializer mixin to share `ViewerState` through serializer context."""
+
+    @property
+    def viewer(self):
+        context = self.context
+        if 'viewer' not in context:
+            context['viewer'] = ViewerState(context['request'].user)
+        return context['viewer']
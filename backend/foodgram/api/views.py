@@ -1,81 +1,150 @@
-from django.db.models import Sum
+import hashlib
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Subquery
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework import filters, serializers, status, viewsets
+from rest_framework import serializers, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 from api.filters import RecipeFilter
+from api.mixins import ConditionalGetMixin
+from api.paginators import RecipePaginator
 from api.permissions import IsAuthorOrAdminOrReadOnly
-from api.serializers import (IngredientSerializer, MiniRecipeSerializer,
-                             RecipeCreateSerializer, RecipeSerializer,
-                             SubscriptionSerializer, TagSerializer)
-from api.utils import delete_for_actions, get_cart_txt, post_for_actions
+from api.serializers import (BulkActionSerializer, CookableRecipeSerializer,
+                             IngredientSerializer, IngredientsQuerySerializer,
+                             MiniRecipeSerializer, RecipeCreateSerializer,
+                             RecipeSerializer, SubscriptionSerializer,
+                             TagSerializer)
+from api.utils import (bulk_delete_for_actions, bulk_post_for_actions,
+                       delete_for_actions, post_for_actions)
+from recipes.cache import (INGREDIENTS_VERSION, TAGS_VERSION, get_cached_cart,
+                           get_version, invalidate_cart)
+from recipes.counters import change_counter
+from recipes.exports import (EXPORT_FORMATS, get_cart_ingredients,
+                             get_cart_response, get_lines)
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
                             ShoppingCart, Tag)
+from recipes.pantry import recipe_ingredient_index
+from recipes.search import ingredient_index, search_ingredients
+from recipes.timeline import get_feed
 from users.models import Subscription, User
 
 
+def bulk_action(request, model):
+    """Apply action to a list of ids, respond with status of each id."""
+    serializer = BulkActionSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = serializer.validated_data['ids']
+    if request.method == 'DELETE':
+        return Response(bulk_delete_for_actions(request.user, ids, model))
+    return Response(bulk_post_for_actions(request.user, ids, model))
+
+
 class SubscriptionsViewSet(viewsets.GenericViewSet):
     """Custom viewset for users subscribe/unsubscribe and
     list of subscriptions."""
     serializer_class = SubscriptionSerializer
     queryset = User.objects.all()
 
+    def get_recipes_limit(self):
+        limit = self.request.query_params.get('recipes_limit', '')
+        return int(limit) if limit.isdigit() else None
+
+    def get_queryset(self):
+        recipes = Recipe.objects.all()
+        limit = self.get_recipes_limit()
+        if limit is not None:
+            top_recipes = Recipe.objects.filter(
+                author=OuterRef('author')).order_by(
+                    '-created').values('pk')[:limit]
+            recipes = recipes.filter(pk__in=Subquery(top_recipes))
+        return super().get_queryset().prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes'))
+
     @action(detail=False,
             permission_classes=[IsAuthenticated, ],
             )
     def subscriptions(self, request):
         user = self.request.user
         subscriptions = user.follower.all().values('author')
-        result = User.objects.filter(id__in=subscriptions)
+        result = self.get_queryset().filter(id__in=subscriptions)
         page = self.paginate_queryset(result)
         serializer = self.get_serializer(page, many=True)
         return self.get_paginated_response(serializer.data)
 
+    @action(detail=False,
+            methods=['post', 'delete'],
+            url_path='subscribe',
+            permission_classes=[IsAuthenticated, ])
+    def bulk_subscribe(self, request):
+        return bulk_action(request, Subscription)
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[IsAuthorOrAdminOrReadOnly, ])
     def subscribe(self, request, pk):
         user = self.request.user
-        author = get_object_or_404(User, pk=pk)
-        serializer = self.get_serializer(author)
-
-        if self.request.method == 'POST':
-            if user == author:
-                raise serializers.ValidationError(
-                    'Нельзя подписаться на самого себя!')
-            post_for_actions(user, author, Subscription)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
         if self.request.method == 'DELETE':
-            delete_for_actions(user, author, Subscription)
-            return Response(serializer.data, status=status.HTTP_204_NO_CONTENT)
+            delete_for_actions(user, pk, Subscription)
+            return Response(status=status.HTTP_204_NO_CONTENT)
 
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        author = get_object_or_404(self.get_queryset(), pk=pk)
+        if user == author:
+            raise serializers.ValidationError(
+                'Нельзя подписаться на самого себя!')
+        post_for_actions(user, author, Subscription)
+        serializer = self.get_serializer(author)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class TagsViewSet(viewsets.ReadOnlyModelViewSet):
+class TagsViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """Viewset to work with tags."""
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     pagination_class = None
+    cache_control = {'public': True, 'max_age': settings.CATALOG_MAX_AGE}
+
+    def get_etag(self, request):
+        return f'tags-{get_version(TAGS_VERSION)}'
 
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(ConditionalGetMixin,
+                         viewsets.ReadOnlyModelViewSet):
     """Viewset to work with ingredients."""
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
     pagination_class = None
-    filter_backends = (filters.SearchFilter,)
-    search_fields = ('^name',)
+    cache_control = {'public': True, 'max_age': settings.CATALOG_MAX_AGE}
+
+    def get_etag(self, request):
+        return f'ingredients-{get_version(INGREDIENTS_VERSION)}'
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(self.search, request)
+
+    def search(self, request):
+        name = request.query_params.get('name', '')
+        limit = request.query_params.get('limit', '')
+        limit = int(limit) if limit.isdigit() else None
+        if request.query_params.get('mode') == 'ranked':
+            return Response(search_ingredients(name, limit))
+        return Response(ingredient_index.search(name, limit))
 
 
-class RecipesViewSet(viewsets.ModelViewSet):
+class RecipesViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = RecipeSerializer
-    queryset = Recipe.objects.all()
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        'tags',
+        Prefetch('recipe_ingredients',
+                 queryset=IngredientRecipe.objects.select_related(
+                     'ingredient')),
+    )
     permission_classes = [IsAuthorOrAdminOrReadOnly, ]
+    pagination_class = RecipePaginator
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
@@ -84,29 +153,111 @@ class RecipesViewSet(viewsets.ModelViewSet):
             return RecipeCreateSerializer
         return RecipeSerializer
 
+    def get_recipe_state(self):
+        """Return values the recipe representation depends on."""
+        pk = str(self.kwargs.get('pk', ''))
+        if self.action != 'retrieve' or not pk.isdigit():
+            return None
+        if not hasattr(self, '_recipe_state'):
+            user = self.request.user
+            queryset = Recipe.objects.filter(pk=pk)
+            # The author is a part of the representation too.
+            fields = ['updated', 'author__updated']
+            if user.is_authenticated:
+                queryset = queryset.annotate(
+                    is_favorited=Exists(
+                        user.favorite.filter(recipe=OuterRef('pk'))),
+                    is_in_shopping_cart=Exists(
+                        user.cart.filter(recipe=OuterRef('pk'))),
+                    is_subscribed=Exists(
+                        user.follower.filter(author=OuterRef('author'))),
+                )
+                fields += ['is_favorited', 'is_in_shopping_cart',
+                           'is_subscribed']
+            self._recipe_state = queryset.values_list(*fields).first()
+        return self._recipe_state
+
+    def get_etag(self, request):
+        state = self.get_recipe_state()
+        if state is None:
+            return None
+        state += (get_version(TAGS_VERSION), get_version(INGREDIENTS_VERSION))
+        return hashlib.md5(repr(state).encode()).hexdigest()
+
+    def get_last_modified(self, request):
+        state = self.get_recipe_state()
+        if state is None or request.user.is_authenticated:
+            return None
+        return int(max(state[:2]).timestamp())
+
+    @action(detail=False,
+            permission_classes=[IsAuthenticated, ])
+    def feed(self, request):
+        """Recipes of followed authors from the user's timeline."""
+        page = self.paginator.paginate_positions(
+            lambda position, limit: get_feed(
+                request.user.id, position, limit), request)
+        recipes = self.get_queryset().in_bulk([pk for _, pk in page])
+        serializer = self.get_serializer(
+            [recipes[pk] for _, pk in page if pk in recipes], many=True)
+        return self.paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def by_ingredients(self, request):
+        """Recipes ranked by the share of their ingredients at hand."""
+        serializer = IngredientsQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        while True:
+            matches = recipe_ingredient_index.search(
+                serializer.validated_data['ingredients'],
+                serializer.validated_data['limit'])
+            recipes = self.get_queryset().in_bulk(
+                [recipe_id for recipe_id, _, _ in matches])
+            # Recipes deleted by another process are unknown to this index.
+            deleted = [recipe_id for recipe_id, _, _ in matches
+                       if recipe_id not in recipes]
+            if not deleted:
+                break
+            recipe_ingredient_index.discard(deleted)
+        for recipe_id, matched, required in matches:
+            recipes[recipe_id].matched_ingredients = matched
+            recipes[recipe_id].missing_ingredients = required - matched
+        return Response(CookableRecipeSerializer(
+            [recipes[recipe_id] for recipe_id, _, _ in matches], many=True,
+            context=self.get_serializer_context()).data)
+
+    def perform_destroy(self, instance):
+        invalidate_cart(*instance.cart.values_list('user_id', flat=True))
+        with transaction.atomic():
+            instance.delete()
+            change_counter(User, instance.author_id, 'recipes_count', -1)
+
 
 class FavoriteViewSet(viewsets.GenericViewSet):
     """Viewset for users favorite recipes."""
     serializer_class = MiniRecipeSerializer
     queryset = Recipe.objects.all()
 
+    @action(detail=False,
+            methods=['post', 'delete'],
+            url_path='favorite',
+            permission_classes=[IsAuthenticated, ])
+    def bulk_favorite(self, request):
+        return bulk_action(request, Favorite)
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[IsAuthorOrAdminOrReadOnly, ])
     def favorite(self, request, pk):
         user = self.request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-        serializer = self.get_serializer(recipe)
-
-        if self.request.method == 'POST':
-            post_for_actions(user, recipe, Favorite)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
         if self.request.method == 'DELETE':
-            delete_for_actions(user, recipe, Favorite)
+            delete_for_actions(user, pk, Favorite)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        recipe = get_object_or_404(Recipe, pk=pk)
+        post_for_actions(user, recipe, Favorite)
+        serializer = self.get_serializer(recipe)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 class ShoppingCartViewSet(viewsets.GenericViewSet):
@@ -114,30 +265,37 @@ class ShoppingCartViewSet(viewsets.GenericViewSet):
     serializer_class = MiniRecipeSerializer
     queryset = Recipe.objects.all()
 
+    @action(detail=False,
+            methods=['post', 'delete'],
+            url_path='shopping_cart',
+            permission_classes=[IsAuthenticated, ])
+    def bulk_shopping_cart(self, request):
+        return bulk_action(request, ShoppingCart)
+
     @action(detail=True,
             methods=['post', 'delete'],
             permission_classes=[IsAuthorOrAdminOrReadOnly, ])
     def shopping_cart(self, request, pk):
         user = self.request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-        serializer = self.get_serializer(recipe)
-
-        if self.request.method == 'POST':
-            post_for_actions(user, recipe, ShoppingCart)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-
         if self.request.method == 'DELETE':
-            delete_for_actions(user, recipe, ShoppingCart)
+            delete_for_actions(user, pk, ShoppingCart)
             return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        recipe = get_object_or_404(Recipe, pk=pk)
+        post_for_actions(user, recipe, ShoppingCart)
+        serializer = self.get_serializer(recipe)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(detail=False,
             methods=['get', ],
             permission_classes=[IsAuthenticated, ],
             )
     def download_shopping_cart(self, request):
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__cart__user=request.user).values(
-            'ingredient__name', 'ingredient__measurement_unit').annotate(
-                total_amount=Sum('amount'))
-        return get_cart_txt(ingredients)
+        export_format = request.query_params.get('type', 'txt')
+        if export_format not in EXPORT_FORMATS:
+            raise serializers.ValidationError(
+                'Доступные форматы: {0}.'.format(', '.join(EXPORT_FORMATS)))
+        ingredients = get_cart_ingredients(
+            IngredientRecipe.objects.filter(recipe__cart__user=request.user))
+        lines = get_cached_cart(request.user.id, get_lines(ingredients))
+        return get_cart_response(lines, export_format)
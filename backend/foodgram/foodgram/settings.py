@@ -31,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,6 +72,17 @@ DATABASES = {
     }
 }
 
+# Versions, token and shopping list caches must be shared by all workers,
+# the database cache needs `manage.py createcachetable`.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            default='django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='django_cache'),
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -104,7 +116,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     "DEFAULT_PAGINATION_CLASS":
@@ -130,3 +142,74 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+SHOPPING_CART_CACHE_TIMEOUT = 60 * 60
+
+SHOPPING_CART_CACHE_MAX_LINES = 1000
+
+INGREDIENT_INDEX_TTL = 5 * 60
+
+INGREDIENT_SEARCH_SIMILARITY = 0.3
+
+CATALOG_MAX_AGE = 5 * 60
+
+RECIPE_IMAGE_MAX_SIZE = 5 * 1024 * 1024
+
+RECIPE_IMAGE_MAX_DIMENSION = 4096
+
+IMAGE_RENDITION_QUEUE = os.getenv(
+    'IMAGE_RENDITION_QUEUE', default='recipes.images.ThreadPoolQueue')
+
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', default=2))
+
+BULK_ACTIONS_MAX_BATCH = 100
+
+AUTH_TOKEN_CACHE = os.getenv('AUTH_TOKEN_CACHE', default='True') == 'True'
+
+AUTH_TOKEN_CACHE_SIZE = 10000
+
+AUTH_TOKEN_CACHE_LOCAL_TTL = 10
+
+AUTH_TOKEN_CACHE_TIMEOUT = 5 * 60
+
+PERFORMANCE_METRICS = os.getenv(
+    'PERFORMANCE_METRICS', default='False') == 'True'
+
+PERFORMANCE_QUERY_BUDGET = 20
+
+# Clients allowed to read /metrics besides staff, nginx does not proxy it.
+PERFORMANCE_METRICS_NETWORKS = os.getenv(
+    'PERFORMANCE_METRICS_NETWORKS',
+    default='127.0.0.0/8,::1/128,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16',
+).split(',')
+
+TIMELINE_STORE = os.getenv(
+    'TIMELINE_STORE', default='recipes.timeline.DatabaseStore')
+
+TIMELINE_LENGTH = 500
+
+TIMELINE_FANOUT_LIMIT = 10000
+
+RECIPE_SCORE_HALF_LIVES = {
+    'popular': 90 * 24 * 60 * 60,
+    'trending': 24 * 60 * 60,
+}
+
+RECIPE_SCORE_WEIGHTS = {
+    'recipe': 0.1,
+    'favorite': 1,
+    'cart': 2,
+}
+
+RECIPE_INDEX_MAX_CHANGES = 10000
+
+RECIPE_INDEX_WARM_UP = os.getenv(
+    'RECIPE_INDEX_WARM_UP', default='True') == 'True'
+
+RECIPE_SEARCH_MAX_INGREDIENTS = 50
+
+RECIPE_SEARCH_MAX_RESULTS = 50
@@ -7,8 +7,14 @@ https://docs.djangoproject.com/en/2.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+if settings.RECIPE_INDEX_WARM_UP:
+    from recipes.pantry import recipe_ingredient_index
+
+    recipe_ingredient_index.warm_up()
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from recipes.exports import get_cart_ingredients, get_cart_response, get_lines
 from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
                             ShoppingCart, Tag)
 
@@ -24,9 +25,10 @@ class RecipeAdmin(admin.ModelAdmin):
     inlines = (IngredienRecipeInline,)
 
     def qty_of_favorites(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
 
     qty_of_favorites.short_description = 'Количество в избранном'
+    qty_of_favorites.admin_order_field = 'favorites_count'
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -65,9 +67,19 @@ class FavoriteAndCartAdmin(admin.ModelAdmin):
     list_filter = ('user',)
 
 
+class ShoppingCartAdmin(FavoriteAndCartAdmin):
+    actions = ('download_shopping_cart',)
+
+    def download_shopping_cart(self, request, queryset):
+        return get_cart_response(get_lines(get_cart_ingredients(
+            IngredientRecipe.objects.filter(recipe__cart__in=queryset))))
+
+    download_shopping_cart.short_description = 'Скачать сводный список покупок'
+
+
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Favorite, FavoriteAndCartAdmin)
-admin.site.register(ShoppingCart, FavoriteAndCartAdmin)
+admin.site.register(ShoppingCart, ShoppingCartAdmin)
 admin.site.register(IngredientRecipe, IngredientRecipeAdmin)
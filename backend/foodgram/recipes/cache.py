@@ -0,0 +1,88 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+CART_STATS = ('hits', 'misses', 'evictions')
+INGREDIENTS_VERSION = 'ingredients'
+RECIPES_VERSION = 'recipes'
+TAGS_VERSION = 'tags'
+
+
+def _initial_version():
+    # Start from the current time, so a version lost by the cache backend
+    # never comes back to a value that was already used.
+    return int(time.time() * 1000)
+
+
+def get_version(name):
+    """Return current version of a cached resource."""
+    return cache.get_or_set(f'version:{name}', _initial_version, None)
+
+
+def bump_version(name):
+    """Increase version of a cached resource and return the new one."""
+    key = f'version:{name}'
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = _initial_version()
+        cache.set(key, version, None)
+        return version
+
+
+def _count(stat):
+    key = f'shopping_cart:{stat}'
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def get_cart_stats():
+    """Return hit, miss and eviction counters of shopping lists cache."""
+    values = cache.get_many([f'shopping_cart:{stat}' for stat in CART_STATS])
+    return {stat: values.get(f'shopping_cart:{stat}', 0)
+            for stat in CART_STATS}
+
+
+def _cart_key(user_id, version):
+    return f'shopping_cart:{user_id}:{version}'
+
+
+def invalidate_cart(*user_ids):
+    """Drop cached shopping lists of the given users."""
+    for user_id in user_ids:
+        version = bump_version(f'cart:{user_id}')
+        key = _cart_key(user_id, version - 1)
+        if key in cache:
+            cache.delete(key)
+            _count('evictions')
+
+
+def _cache_lines(key, lines):
+    buffer = []
+    for line in lines:
+        if buffer is not None:
+            buffer.append(line)
+            if len(buffer) > settings.SHOPPING_CART_CACHE_MAX_LINES:
+                buffer = None
+        yield line
+    if buffer is not None:
+        cache.set(key, buffer, settings.SHOPPING_CART_CACHE_TIMEOUT)
+
+
+def get_cached_cart(user_id, lines):
+    """Return shopping list lines of the user from cache.
+
+    On a miss `lines` are passed through and stored once exhausted,
+    unless the list is too long to be kept in cache.
+    """
+    key = _cart_key(user_id, get_version(f'cart:{user_id}'))
+    cached = cache.get(key)
+    if cached is not None:
+        _count('hits')
+        return cached
+    _count('misses')
+    return _cache_lines(key, lines)
@@ -0,0 +1,39 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscription, User
+
+# Counter columns and the relations they count:
+# (model, counter field, related model, related field pointing to model).
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+)
+
+
+def change_counter(model, pk, field, delta=1):
+    """Atomically add delta to the counter column of the row.
+
+    The result is clamped at zero, so a counter drifted below the actual
+    number of rows does not fail the unsigned column check.
+    """
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
+
+def count_related(related_model, related_field):
+    """Correlated subquery counting related rows of the outer object."""
+    return Coalesce(Subquery(
+        related_model.objects.filter(
+            **{related_field: OuterRef('pk')}).order_by().values(
+                related_field).annotate(count=Count('pk')).values('count')),
+        0)
+
+
+def recount(model, field, related_model, related_field, pks):
+    """Set the counter of the given rows to the actual number of rows."""
+    model.objects.filter(pk__in=pks).update(
+        **{field: count_related(related_model, related_field)})
@@ -0,0 +1,107 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+
+CART_TITLE = 'Ваш список покупок:'
+CART_FILENAME = 'shopping_cart'
+CART_FIELDS = ('Ингредиент', 'Единицы измерения', 'Количество')
+
+
+def get_cart_ingredients(queryset):
+    """Aggregate `IngredientRecipe` rows into shopping list lines."""
+    return queryset.values(
+        'ingredient__name', 'ingredient__measurement_unit').annotate(
+            total_amount=Sum('amount')).order_by(
+                'ingredient__name', 'ingredient__measurement_unit')
+
+
+def get_lines(ingredients):
+    """Iterate over aggregated ingredients using a server-side cursor."""
+    for ingredient in ingredients.iterator():
+        yield (ingredient['ingredient__name'],
+               ingredient['ingredient__measurement_unit'],
+               ingredient['total_amount'])
+
+
+class Echo:
+    """File-like object that returns written value instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def render_txt(lines):
+    yield f'{CART_TITLE}\n\n'
+    for name, unit, amount in lines:
+        yield f'{name} ({unit}): {amount}\n'
+
+
+def render_csv(lines):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CART_FIELDS)
+    for line in lines:
+        yield writer.writerow(line)
+
+
+def render_json(lines):
+    yield '['
+    for index, (name, unit, amount) in enumerate(lines):
+        yield (', ' if index else '') + json.dumps(
+            {'name': name, 'measurement_unit': unit, 'amount': amount},
+            ensure_ascii=False)
+    yield ']'
+
+
+def render_pdf(lines):
+    """Render shopping list to PDF.
+
+    PDF needs a cross-reference table with offsets of the whole document,
+    so the file is built in memory and then streamed in chunks.
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+
+    font = 'ShoppingCartFont'
+    pdfmetrics.registerFont(TTFont(font, settings.SHOPPING_CART_PDF_FONT))
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    top, margin = A4[1] - 50, 50
+    text = pdf.beginText(margin, top)
+    text.setFont(font, 16, leading=30)
+    text.textLine(CART_TITLE)
+    text.setFont(font, 12, leading=20)
+    for name, unit, amount in lines:
+        if text.getY() < margin:
+            pdf.drawText(text)
+            pdf.showPage()
+            text = pdf.beginText(margin, top)
+            text.setFont(font, 12, leading=20)
+        text.textLine(f'{name} ({unit}): {amount}')
+    pdf.drawText(text)
+    pdf.save()
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(64 * 1024), b'')
+
+
+EXPORT_FORMATS = {
+    'txt': (render_txt, 'text/plain; charset=utf-8'),
+    'csv': (render_csv, 'text/csv; charset=utf-8'),
+    'json': (render_json, 'application/json'),
+    'pdf': (render_pdf, 'application/pdf'),
+}
+
+
+def get_cart_response(lines, export_format='txt'):
+    """Stream shopping list lines as a file of the chosen format."""
+    render, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(
+        render(lines), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename={0}.{1}'.format(
+        CART_FILENAME, export_format)
+    return response
@@ -0,0 +1,164 @@
+import base64
+import binascii
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+DECODE_CHUNK_SIZE = 64 * 1024
+
+RENDITIONS_DIR = 'renditions'
+
+RENDITIONS = {
+    'thumbnail': (320, 320),
+    'medium': (800, 800),
+}
+
+RENDITION_FORMATS = {
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+
+
+def decode_base64(data, name):
+    """Decode base64 payload chunk by chunk into a spooled temporary file.
+
+    Raises ValueError if the payload is malformed.
+    """
+    file = SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    try:
+        for start in range(0, len(data), DECODE_CHUNK_SIZE):
+            file.write(base64.b64decode(
+                data[start:start + DECODE_CHUNK_SIZE], validate=True))
+    except binascii.Error as error:
+        file.close()
+        raise ValueError(error) from error
+    file.seek(0)
+    return File(file, name=name)
+
+
+def rendition_name(name, rendition, extension):
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return f'{directory}/{RENDITIONS_DIR}/{stem}_{rendition}.{extension}'
+
+
+def rendition_source_stem(filename):
+    """Return the original image name stem of a rendition file."""
+    return os.path.splitext(filename)[0].rsplit('_', 1)[0]
+
+
+def rendition_names(name, renditions=RENDITIONS):
+    """Map rendition keys like `thumbnail_webp` to file names."""
+    names = {}
+    for rendition in renditions:
+        for extension in RENDITION_FORMATS:
+            key = rendition if extension == 'jpg' else (
+                f'{rendition}_{extension}')
+            names[key] = rendition_name(name, rendition, extension)
+    return names
+
+
+def open_image(storage, name):
+    with storage.open(name) as file:
+        image = Image.open(file)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_renditions(recipe_id, name):
+    """Store resized and recompressed copies of the recipe image.
+
+    Copies keep predictable names next to the original, so they go to the
+    default storage rather than to the content-addressed image storage.
+    """
+    image = open_image(Recipe._meta.get_field('image').storage, name)
+    for rendition, size in RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        for extension, (image_format, options) in RENDITION_FORMATS.items():
+            target = rendition_name(name, rendition, extension)
+            if default_storage.exists(target):
+                continue
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format, **options)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+    # update() skips auto_now, and the detail ETag depends on `updated`.
+    Recipe.objects.filter(pk=recipe_id, image=name).update(
+        has_renditions=True, updated=timezone.now())
+
+
+def run_job(recipe_id, name):
+    try:
+        generate_renditions(recipe_id, name)
+    except Exception:
+        logger.exception('Failed to render images of recipe %s', recipe_id)
+    finally:
+        connection.close()
+
+
+class ThreadPoolQueue:
+    """Runs rendition jobs in a background pool of worker threads."""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_RENDITION_WORKERS,
+            thread_name_prefix='renditions')
+
+    def submit(self, recipe_id, name):
+        self.executor.submit(run_job, recipe_id, name)
+
+    def join(self):
+        """Wait for the submitted jobs to finish."""
+        self.executor.shutdown(wait=True)
+        self.__init__()
+
+
+class LocalQueue:
+    """Keeps jobs until `run` is called, a stand-in for tests."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def submit(self, recipe_id, name):
+        self.jobs.append((recipe_id, name))
+
+    def run(self):
+        jobs, self.jobs = self.jobs, []
+        for recipe_id, name in jobs:
+            generate_renditions(recipe_id, name)
+
+    join = run
+
+
+@lru_cache(maxsize=None)
+def get_queue():
+    return import_string(settings.IMAGE_RENDITION_QUEUE)()
+
+
+def schedule_renditions(recipe):
+    """Queue rendition generation for the current image of the recipe."""
+    if recipe.image:
+        get_queue().submit(recipe.pk, recipe.image.name)
@@ -0,0 +1,275 @@
+import json
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes import synthetic
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.scores import SCORES
+from users.models import User
+
+LOWER_IS_BETTER = ('p50', 'p95', 'p99', 'mean', 'queries')
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def get_scenarios(rnd):
+    """Endpoints to measure: name, method, path factory, authenticated."""
+    recipe_ids = list(Recipe.objects.values_list('id', flat=True)[:1000])
+    tags = list(Tag.objects.values_list('slug', flat=True))
+    names = list(Ingredient.objects.values_list('name', flat=True)[:1000])
+    author_ids = list(User.objects.filter(
+        recipes_count__gt=0).values_list('id', flat=True)[:1000])
+    return (
+        ('recipes_anonymous', 'get', lambda: '/api/recipes/', False),
+        ('recipes', 'get', lambda: '/api/recipes/?limit=6', True),
+        ('recipes_cursor', 'get', lambda: '/api/recipes/?cursor=', True),
+        ('recipes_filtered', 'get',
+         lambda: f'/api/recipes/?tags={rnd.choice(tags)}&is_favorited=1',
+         True),
+        ('recipes_popular', 'get',
+         lambda: f'/api/recipes/?ordering={rnd.choice(SCORES)}', True),
+        ('recipes_by_author', 'get',
+         lambda: f'/api/recipes/?author={rnd.choice(author_ids)}', True),
+        ('feed', 'get', lambda: '/api/recipes/feed/', True),
+        ('recipe_detail', 'get',
+         lambda: f'/api/recipes/{rnd.choice(recipe_ids)}/', True),
+        ('ingredients_search', 'get',
+         lambda: f'/api/ingredients/?name={rnd.choice(names)[:3]}', False),
+        ('tags', 'get', lambda: '/api/tags/', False),
+        ('subscriptions', 'get',
+         lambda: '/api/users/subscriptions/?recipes_limit=3', True),
+        ('shopping_cart_download', 'get',
+         lambda: '/api/recipes/download_shopping_cart/', True),
+        ('favorite_toggle', 'post',
+         lambda: f'/api/recipes/{rnd.choice(recipe_ids)}/favorite/', True),
+    )
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class TestClientDriver:
+    """Sends requests through the Django test client, counts queries."""
+
+    def request(self, method, path, token):
+        client = APIClient()
+        if token:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            response = getattr(client, method)(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - started
+        if method == 'post' and response.status_code == 201:
+            client.delete(path)
+        return elapsed, counter.count, response.status_code
+
+
+class HttpDriver:
+    """Sends requests to a running server, reads query counts from the
+    `Server-Timing` header when the performance middleware is on."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def send(self, method, path, token):
+        request = Request(self.url + path, method=method.upper())
+        if token:
+            request.add_header('Authorization', f'Token {token}')
+        try:
+            with urlopen(request) as response:
+                response.read()
+        except HTTPError as error:
+            response = error
+        return response.getcode(), response.headers.get('Server-Timing', '')
+
+    def request(self, method, path, token):
+        started = time.perf_counter()
+        status, timing = self.send(method, path, token)
+        elapsed = time.perf_counter() - started
+        if method == 'post' and status == 201:
+            self.send('delete', path, token)
+        queries = None
+        if 'queries"' in timing:
+            queries = int(timing.split('desc="')[1].split(' ')[0])
+        return elapsed, queries, status
+
+
+class Command(BaseCommand):
+    help = "measure latency, throughput and queries of API endpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--favorites', type=int, default=20)
+        parser.add_argument('--carts', type=int, default=5)
+        parser.add_argument('--subscriptions', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=20)
+        parser.add_argument('--scenario', action='append',
+                            help='run only the named scenarios')
+        parser.add_argument(
+            '--url', help='benchmark a running server, e.g. '
+                          'http://127.0.0.1:8000, using the data already '
+                          'in the configured database')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='parallel clients, only with --url')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='keep and reuse the seeded test database')
+        parser.add_argument('--output', help='write results to a JSON file')
+        parser.add_argument('--compare',
+                            help='JSON results of a previous run')
+        parser.add_argument('--threshold', type=float, default=10.0,
+                            help='regression threshold in percent')
+
+    def run_scenario(self, driver, scenario, tokens, options):
+        name, method, get_path, authenticated = scenario
+        rnd = random.Random(options['seed'])
+
+        def call(_):
+            token = rnd.choice(tokens) if authenticated else None
+            return driver.request(method, get_path(), token)
+
+        for number in range(options['warmup']):
+            call(number)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            results = list(executor.map(call, range(options['requests'])))
+        wall = time.perf_counter() - started
+        timings = sorted(elapsed * 1000 for elapsed, _, _ in results)
+        queries = [count for _, count, _ in results if count is not None]
+        return {
+            'p50': percentile(timings, 0.5),
+            'p95': percentile(timings, 0.95),
+            'p99': percentile(timings, 0.99),
+            'mean': sum(timings) / len(timings),
+            'rps': len(timings) / wall,
+            'queries': sum(queries) / len(queries) if queries else None,
+            'errors': sum(status >= 400 for _, _, status in results),
+        }
+
+    def benchmark(self, driver, options):
+        rnd = random.Random(options['seed'])
+        tokens = list(Token.objects.order_by('user_id').values_list(
+            'key', flat=True)[:1000])
+        if not tokens:
+            raise CommandError('There are no users with tokens to log in.')
+        results = {}
+        for scenario in get_scenarios(rnd):
+            if options['scenario'] and scenario[0] not in options['scenario']:
+                continue
+            cache.clear()
+            results[scenario[0]] = self.run_scenario(
+                driver, scenario, tokens, options)
+            self.write_row(scenario[0], results[scenario[0]])
+        return results
+
+    def write_row(self, name, stats):
+        queries = '-' if stats['queries'] is None else (
+            f'{stats["queries"]:.1f}')
+        self.stdout.write(
+            f'{name:<24} p50 {stats["p50"]:8.2f} ms  '
+            f'p95 {stats["p95"]:8.2f} ms  p99 {stats["p99"]:8.2f} ms  '
+            f'{stats["rps"]:8.1f} rps  {queries:>5} queries  '
+            f'{stats["errors"]} errors')
+
+    def seed(self, options):
+        if User.objects.exists():
+            self.stdout.write('Reusing the existing test database.')
+            return
+        started = time.perf_counter()
+        synthetic.seed(
+            users=options['users'], recipes=options['recipes'],
+            favorites=options['favorites'], carts=options['carts'],
+            subscriptions=options['subscriptions'], seed=options['seed'])
+        self.stdout.write(
+            f'Seeded in {time.perf_counter() - started:.1f} s.')
+
+    def run_in_test_database(self, options):
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            self.seed(options)
+            return self.benchmark(TestClientDriver(), options)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+    def get_metadata(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'database': connection.vendor,
+            'url': options['url'],
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'options': {key: options[key] for key in (
+                'users', 'recipes', 'favorites', 'carts', 'subscriptions',
+                'seed', 'requests', 'warmup', 'concurrency')},
+        }
+
+    def compare(self, results, path, threshold):
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        regressions = []
+        for name, stats in results.items():
+            if name not in previous:
+                continue
+            changes = []
+            for stat in LOWER_IS_BETTER:
+                old, new = previous[name].get(stat), stats[stat]
+                if not old or new is None:
+                    continue
+                change = (new - old) / old * 100
+                changes.append(f'{stat} {change:+.1f}%')
+                if change > threshold:
+                    regressions.append(f'{name} {stat} {change:+.1f}%')
+            self.stdout.write(f'{name:<24} ' + '  '.join(changes))
+        return regressions
+
+    def handle(self, *args, **options):
+        if options['url']:
+            results = self.benchmark(HttpDriver(options['url']), options)
+        else:
+            if options['concurrency'] != 1:
+                raise CommandError('--concurrency needs --url.')
+            results = self.run_in_test_database(options)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({'metadata': self.get_metadata(options),
+                           'results': results}, file, indent=2)
+        if options['compare']:
+            regressions = self.compare(
+                results, options['compare'], options['threshold'])
+            if regressions:
+                raise CommandError(
+                    'Regressions: ' + ', '.join(regressions))
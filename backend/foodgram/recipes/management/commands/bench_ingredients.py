@@ -0,0 +1,88 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from recipes.models import Ingredient
+from recipes.search import (get_ranked_queryset, ingredient_index,
+                            search_ingredients, set_similarity_threshold)
+
+
+def misspell(word, rnd):
+    if len(word) < 4:
+        return word
+    position = rnd.randrange(1, len(word) - 1)
+    return word[:position] + word[position + 1:]
+
+
+class Command(BaseCommand):
+    help = "compare ingredient search modes on the current catalog"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def get_queries(self, count, seed):
+        rnd = random.Random(seed)
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            return []
+        queries = []
+        for _ in range(count):
+            name = rnd.choice(names)
+            queries.append(rnd.choice((
+                name[:rnd.randint(1, max(1, len(name)))],
+                misspell(name, rnd),
+                ' '.join(word[:4] for word in reversed(name.split())),
+            )))
+        return queries
+
+    def measure(self, title, search, queries):
+        timings, found = [], 0
+        for query in queries:
+            start = time.perf_counter()
+            found += bool(search(query))
+            timings.append((time.perf_counter() - start) * 1e6)
+        timings.sort()
+        self.stdout.write(
+            f'{title:<22} mean {statistics.mean(timings):>10.1f} us  '
+            f'p95 {timings[int(len(timings) * 0.95)]:>10.1f} us  '
+            f'found {found}/{len(queries)}')
+
+    def explain(self, query, limit):
+        """Show the plan of the ranked query, it must not read the table."""
+        with transaction.atomic():
+            set_similarity_threshold()
+            plan = get_ranked_queryset(query)[:limit].explain()
+        self.stdout.write(f'plan of {query!r}:\n{plan}')
+        if 'Seq Scan on recipes_ingredient' in plan:
+            self.stderr.write('The ranked query reads all ingredients, '
+                              'is the trigram index missing?')
+
+    def handle(self, *args, **options):
+        queries = self.get_queries(options['queries'], options['seed'])
+        if not queries:
+            self.stderr.write('Ingredients catalog is empty.')
+            return
+        limit = options['limit']
+        ingredient_index.refresh()
+        self.measure(
+            'database ^name',
+            lambda query: list(Ingredient.objects.filter(
+                name__istartswith=query).values('id')[:limit]),
+            queries)
+        self.measure(
+            'index prefix',
+            lambda query: ingredient_index.search(query, limit), queries)
+        self.measure(
+            'index ranked',
+            lambda query: ingredient_index.search_ranked(query, limit),
+            queries)
+        self.measure(
+            'ranked (backend)',
+            lambda query: search_ingredients(query, limit), queries)
+        if connection.vendor == 'postgresql':
+            self.explain(queries[0], limit)
@@ -0,0 +1,100 @@
+import random
+import statistics
+import time
+from array import array
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, FloatField, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from recipes.models import Ingredient, Recipe
+from recipes.pantry import make_index, rank, recipe_ingredient_index
+from recipes.synthetic import pick_ranks
+
+
+def get_size(index):
+    """Bytes taken by the index arrays."""
+    return sum(posting.itemsize * len(posting)
+               for posting in index.postings.values()) + (
+        index.sizes.itemsize * len(index.sizes))
+
+
+def search_database(pantry, limit):
+    """Rank recipes by coverage with one aggregate over all ingredients."""
+    return list(Recipe.objects.annotate(
+        matched=Count('recipe_ingredients', filter=Q(
+            recipe_ingredients__ingredient__in=pantry)),
+        required=Count('recipe_ingredients'),
+    ).filter(matched__gt=0).annotate(
+        coverage=Cast('matched', FloatField()) / F('required'),
+    ).order_by('-coverage', '-matched', '-pk').values_list(
+        'pk', 'matched', 'required')[:limit])
+
+
+class Command(BaseCommand):
+    help = ("measure search of recipes by ingredients at hand on the "
+            "current database or on a synthetic index of --recipes size")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=0,
+                            help='build a synthetic index of this many '
+                                 'recipes, e.g. 1000000, without the '
+                                 'database')
+        parser.add_argument('--catalog', type=int, default=2200,
+                            help='ingredients in the synthetic catalog')
+        parser.add_argument('--min-ingredients', type=int, default=5)
+        parser.add_argument('--max-ingredients', type=int, default=30)
+        parser.add_argument('--exponent', type=float, default=1.0,
+                            help='Zipf exponent of ingredient popularity')
+        parser.add_argument('--pantry', type=int, default=10,
+                            help='ingredients at hand per query')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def build_synthetic(self, options, rnd):
+        postings = {}
+        for recipe_id in range(1, options['recipes'] + 1):
+            size = rnd.randint(
+                options['min_ingredients'], options['max_ingredients'])
+            for rank_ in pick_ranks(rnd, options['catalog'], size,
+                                    options['exponent']):
+                postings.setdefault(rank_ + 1, array('I')).append(recipe_id)
+        return make_index(postings, timezone.now())
+
+    def measure(self, title, search, queries, limit):
+        timings = []
+        for pantry in queries:
+            started = time.perf_counter()
+            search(pantry, limit)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f'{title:<20} mean {statistics.mean(timings):>9.2f} ms  '
+            f'p95 {timings[int(len(timings) * 0.95)]:>9.2f} ms')
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        started = time.perf_counter()
+        if options['recipes']:
+            index = self.build_synthetic(options, rnd)
+            catalog = list(range(1, options['catalog'] + 1))
+        else:
+            recipe_ingredient_index.refresh()
+            index = recipe_ingredient_index._index
+            catalog = list(Ingredient.objects.values_list('id', flat=True))
+        self.stdout.write(
+            f'Index of {len(index.sizes) - 1} recipes, '
+            f'{get_size(index) / 2 ** 20:.1f} MiB, '
+            f'built in {time.perf_counter() - started:.1f} s.')
+        if len(catalog) < options['pantry']:
+            self.stderr.write('Ingredients catalog is too small.')
+            return
+        queries = [frozenset(rnd.sample(catalog, options['pantry']))
+                   for _ in range(options['queries'])]
+        limit = options['limit']
+        self.measure('index', lambda pantry, limit: rank(
+            index, pantry, limit), queries, limit)
+        if not options['recipes']:
+            self.measure('database', search_database, queries, limit)
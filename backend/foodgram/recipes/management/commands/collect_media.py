@@ -0,0 +1,83 @@
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from recipes.images import RENDITIONS_DIR, rendition_source_stem
+from recipes.models import Recipe
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class Command(BaseCommand):
+    help = "remove recipe images and renditions not used by any recipe"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='keep files younger than this many seconds, they may '
+                 'belong to recipes not committed yet')
+
+    def is_recent(self, storage, name):
+        modified = storage.get_modified_time(name).timestamp()
+        return time.time() - modified < self.min_age
+
+    def remove(self, storage, name):
+        self.removed += 1
+        self.freed += storage.size(name)
+        self.stdout.write(f'{"would remove" if self.dry_run else "remove"} '
+                          f'{name}')
+        if not self.dry_run:
+            storage.delete(name)
+
+    def collect_images(self, storage, directory, files):
+        """Remove unused images, return name stems of the kept ones."""
+        kept = set()
+        for batch in batches(files, self.batch_size):
+            names = [os.path.join(directory, file) for file in batch]
+            used = set(Recipe.objects.filter(image__in=names).values_list(
+                'image', flat=True))
+            for name in names:
+                if name in used or self.is_recent(storage, name):
+                    kept.add(os.path.splitext(os.path.basename(name))[0])
+                else:
+                    self.remove(storage, name)
+        return kept
+
+    def collect_renditions(self, directory, kept):
+        storage = default_storage
+        for file in storage.listdir(directory)[1]:
+            name = os.path.join(directory, file)
+            if (rendition_source_stem(file) not in kept
+                    and not self.is_recent(storage, name)):
+                self.remove(storage, name)
+
+    def collect(self, storage, directory):
+        """Walk directories one by one, holding one listing at a time."""
+        directories, files = storage.listdir(directory)
+        kept = self.collect_images(storage, directory, sorted(files))
+        for subdirectory in sorted(directories):
+            path = os.path.join(directory, subdirectory)
+            if subdirectory == RENDITIONS_DIR:
+                self.collect_renditions(path, kept)
+            else:
+                self.collect(storage, path)
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        self.min_age = options['min_age']
+        self.removed = self.freed = 0
+        field = Recipe._meta.get_field('image')
+        directory = field.upload_to.strip('/')
+        if field.storage.exists(directory):
+            self.collect(field.storage, directory)
+        self.stdout.write(
+            f'{"Found" if self.dry_run else "Removed"} {self.removed} '
+            f'files, {self.freed / 1024 / 1024:.1f} MB.')
@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from recipes import synthetic
+from recipes.models import Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ("generate a large dataset with skewed popularity of recipes "
+            "and authors for load tests")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--favorites', type=float, default=20,
+                            help='mean favorites per user')
+        parser.add_argument('--carts', type=float, default=3,
+                            help='mean shopping cart recipes per user')
+        parser.add_argument('--subscriptions', type=float, default=10,
+                            help='mean subscriptions per user')
+        parser.add_argument('--min-ingredients', type=int, default=5)
+        parser.add_argument('--max-ingredients', type=int, default=30)
+        parser.add_argument('--popularity-exponent', type=float, default=1.1,
+                            help='Zipf exponent of recipe popularity')
+        parser.add_argument('--followers-exponent', type=float, default=1.2,
+                            help='Zipf exponent of followers per author')
+        parser.add_argument('--authors-exponent', type=float, default=1.0,
+                            help='Zipf exponent of recipes per author')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--processes', type=int,
+                            default=os.cpu_count() or 1)
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='users or recipes per task')
+
+    def run_tasks(self, tasks):
+        if self.processes == 1:
+            yield from map(synthetic.run_task, tasks)
+            return
+        # Forked workers must open their own database connections.
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(
+                self.processes) as pool:
+            yield from pool.imap_unordered(synthetic.run_task, tasks)
+
+    def run_phase(self, name, function, first_id, count, options):
+        started = time.perf_counter()
+        tasks = [(function, start, min(start + self.chunk_size,
+                                       first_id + count), options)
+                 for start in range(first_id, first_id + count,
+                                    self.chunk_size)]
+        done = 0
+        for size in self.run_tasks(tasks):
+            done += size
+            self.stdout.write(f'\r{name}: {done}/{count}', ending='')
+            self.stdout.flush()
+        self.stdout.write(
+            f'\r{name}: {done}/{count} in '
+            f'{time.perf_counter() - started:.1f} s')
+
+    def get_options(self, options):
+        if options['users'] < 1 or options['recipes'] < 1:
+            raise CommandError('--users and --recipes must be positive.')
+        if not 1 <= options['min_ingredients'] <= options['max_ingredients']:
+            raise CommandError(
+                '--min-ingredients must be between 1 and --max-ingredients.')
+        tag_ids = synthetic.create_tags()
+        ingredient_ids = synthetic.create_ingredients()
+        return {
+            'seed': options['seed'],
+            'users': options['users'],
+            'recipes': options['recipes'],
+            'first_user': synthetic.get_last_id(User) + 1,
+            'first_recipe': synthetic.get_last_id(Recipe) + 1,
+            'favorites': options['favorites'],
+            'carts': options['carts'],
+            'subscriptions': options['subscriptions'],
+            'tag_ids': tag_ids,
+            'ingredient_ids': ingredient_ids,
+            'ingredients_range': (
+                min(options['min_ingredients'], len(ingredient_ids)),
+                min(options['max_ingredients'], len(ingredient_ids))),
+            'popularity_exponent': options['popularity_exponent'],
+            'followers_exponent': options['followers_exponent'],
+            'authors_exponent': options['authors_exponent'],
+        }
+
+    def handle(self, *args, **options):
+        self.chunk_size = options['chunk_size']
+        self.processes = max(1, options['processes'])
+        if connection.vendor == 'sqlite' and self.processes > 1:
+            self.stdout.write('SQLite allows a single writer, '
+                              'running in one process.')
+            self.processes = 1
+        started = time.perf_counter()
+        generation = self.get_options(options)
+        self.run_phase('users', synthetic.generate_users,
+                       generation['first_user'], generation['users'],
+                       generation)
+        self.run_phase('recipes', synthetic.generate_recipes,
+                       generation['first_recipe'], generation['recipes'],
+                       generation)
+        self.run_phase('favorites, carts, subscriptions',
+                       synthetic.generate_user_relations,
+                       generation['first_user'], generation['users'],
+                       generation)
+        synthetic.reset_sequences()
+        synthetic.update_counters()
+        call_command('rebuild_timelines', stdout=self.stdout)
+        call_command('refresh_scores', full=True, stdout=self.stdout)
+        self.stdout.write(
+            f'Done in {time.perf_counter() - started:.1f} s.')
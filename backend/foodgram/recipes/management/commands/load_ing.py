@@ -1,24 +1,135 @@
 import csv
+import json
+import os
+import time
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 
+from recipes.cache import INGREDIENTS_VERSION, bump_version
 from recipes.models import Ingredient
 
-PATH = "data"
+PATH = os.path.join("data", "ingredients.csv")
+
+CSV_HEADERS = ('name', 'название')
+
+JSON_SEPARATORS = ' \t\r\n,[]'
+
+FIXTURE_MODEL = 'recipes.ingredient'
+
+
+def resolve_path(path):
+    """Look for relative paths in the current directory, then in BASE_DIR."""
+    if os.path.isabs(path) or os.path.exists(path):
+        return path
+    return os.path.join(settings.BASE_DIR, path)
+
+
+def read_csv(file):
+    """Yield (name, measurement_unit) rows, skipping an optional header."""
+    reader = csv.reader(file)
+    for row in reader:
+        if reader.line_num == 1 and row and (
+                row[0].strip().casefold() in CSV_HEADERS):
+            continue
+        yield (row + ['', ''])[:2]
+
+
+def read_json_array(file, chunk_size=64 * 1024):
+    """Yield objects of a top-level JSON array without loading it whole."""
+    decoder = json.JSONDecoder()
+    buffer, position = '', 0
+    while True:
+        while position < len(buffer) and buffer[position] in JSON_SEPARATORS:
+            position += 1
+        try:
+            if position == len(buffer):
+                raise ValueError
+            item, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                if position < len(buffer):
+                    raise
+                return
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield item
+
+
+def read_json(file):
+    """Yield rows of a plain list of ingredients or of a Django fixture."""
+    for item in read_json_array(file):
+        if 'model' in item:
+            if item['model'] != FIXTURE_MODEL:
+                continue
+            item = item['fields']
+        yield item.get('name'), item.get('measurement_unit')
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
+
+def normalize(value):
+    return ' '.join(str(value or '').split()).lower()
 
 
 class Command(BaseCommand):
-    help = "import data from ingredients.csv"
-
-    def handle(self, *args, **kwargs):
-        with open(f"{PATH}/ingredients.csv", encoding="utf-8") as file:
-            reader = csv.reader(file)
-            next(reader)
-            ingredients_to_add = [
-                Ingredient(
-                    name=row[0],
-                    measurement_unit=row[1],
-                )
-                for row in reader
-            ]
-            Ingredient.objects.bulk_create(ingredients_to_add)
+    help = "import ingredients from csv, json or fixture files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=[PATH])
+        parser.add_argument('--format', choices=READERS)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def get_rows(self, path, file_format):
+        file_format = file_format or os.path.splitext(path)[1][1:].lower()
+        if file_format not in READERS:
+            raise CommandError(
+                f'Unknown format of {path}, use --format csv or json.')
+        with open(path, encoding='utf-8', newline='') as file:
+            yield from READERS[file_format](file)
+
+    def save(self, batch):
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=unit)
+             for name, unit in batch], ignore_conflicts=True)
+        batch.clear()
+
+    def import_file(self, path, file_format, batch_size):
+        max_length = Ingredient._meta.get_field('name').max_length
+        batch, rows, skipped = set(), 0, 0
+        started = time.monotonic()
+        for row in self.get_rows(path, file_format):
+            rows += 1
+            name, unit = map(normalize, row)
+            if not name or not unit or max(len(name), len(unit)) > max_length:
+                skipped += 1
+                continue
+            batch.add((name, unit))
+            if len(batch) >= batch_size:
+                self.save(batch)
+                self.report(path, rows, started)
+        self.save(batch)
+        self.report(path, rows, started)
+        return skipped
+
+    def report(self, path, rows, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'{path}: {rows} rows read, '
+                          f'{rows / max(elapsed, 1e-6):.0f} rows/s')
+
+    def handle(self, *args, **options):
+        before = Ingredient.objects.count()
+        skipped = 0
+        for path in options['paths']:
+            skipped += self.import_file(
+                resolve_path(path), options['format'], options['batch_size'])
+        added = Ingredient.objects.count() - before
+        if added:
+            bump_version(INGREDIENTS_VERSION)
+        self.stdout.write(self.style.SUCCESS(
+            f'Added {added} ingredients, skipped {skipped} invalid rows.'))
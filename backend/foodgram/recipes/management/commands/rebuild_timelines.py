@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from recipes import timeline
+from users.models import Subscription
+
+
+class Command(BaseCommand):
+    help = "fill feed timelines of all followers from their subscriptions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--trim', action='store_true',
+                            help='only cut timelines to TIMELINE_LENGTH')
+
+    def handle(self, *args, **options):
+        followers = Subscription.objects.order_by('user_id').values_list(
+            'user_id', flat=True).distinct()
+        done, last_id = 0, 0
+        while True:
+            user_ids = list(followers.filter(
+                user_id__gt=last_id)[:options['batch_size']])
+            if not user_ids:
+                break
+            if options['trim']:
+                timeline.get_store().trim(user_ids)
+            else:
+                for user_id in user_ids:
+                    timeline.rebuild(user_id)
+            done += len(user_ids)
+            last_id = user_ids[-1]
+            self.stdout.write(f'\rtimelines: {done}', ending='')
+            self.stdout.flush()
+        self.stdout.write(f'\rtimelines: {done}')
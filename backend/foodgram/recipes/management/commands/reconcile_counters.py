@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from recipes.counters import COUNTERS, count_related, recount
+
+
+class Command(BaseCommand):
+    help = "recount denormalized counters and fix the drifted ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def reconcile(self, model, field, related_model, related_field):
+        """Walk the table by primary key ranges, one batch at a time."""
+        fixed, last_pk = 0, 0
+        while True:
+            pks = list(model.objects.filter(pk__gt=last_pk).order_by(
+                'pk').values_list('pk', flat=True)[:self.batch_size])
+            if not pks:
+                return fixed
+            last_pk = pks[-1]
+            drifted = list(model.objects.filter(
+                pk__gte=pks[0], pk__lte=last_pk).annotate(
+                    actual=count_related(related_model, related_field)
+            ).exclude(**{field: F('actual')}).order_by().values_list(
+                'pk', flat=True))
+            fixed += len(drifted)
+            if drifted and not self.dry_run:
+                # Recount in the UPDATE itself, so increments made since
+                # the read above are not overwritten.
+                recount(model, field, related_model, related_field,
+                        drifted)
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        for model, field, related_model, related_field in COUNTERS:
+            fixed = self.reconcile(
+                model, field, related_model, related_field)
+            self.stdout.write(
+                f'{model._meta.label}.{field}: '
+                f'{"found" if self.dry_run else "fixed"} {fixed} drifted')
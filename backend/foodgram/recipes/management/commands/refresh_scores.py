@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    help = ("update popular and trending scores of recipes with favorites "
+            "and cart adds made since the previous run")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='recompute all scores, also to forget '
+                                 'removed favorites and cart items')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        until = refresh_scores(options['full'], options['batch_size'])
+        self.stdout.write(
+            f'Scores include events up to {until:%Y-%m-%d %H:%M:%S}, '
+            f'done in {time.perf_counter() - started:.1f} s.')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import get_queue, schedule_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ("queue image renditions of recipes which have none, e.g. "
+            "uploaded before renditions existed or lost on a restart")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        pending = Recipe.objects.filter(has_renditions=False).exclude(
+            image='').order_by('pk')
+        queue = get_queue()
+        done, last_pk = 0, 0
+        while True:
+            recipes = list(pending.filter(pk__gt=last_pk).only(
+                'pk', 'image')[:options['batch_size']])
+            if not recipes:
+                break
+            for recipe in recipes:
+                schedule_renditions(recipe)
+            # Keep at most one batch of jobs in memory.
+            queue.join()
+            done += len(recipes)
+            last_pk = recipes[-1].pk
+            self.stdout.write(f'\rrecipes: {done}', ending='')
+            self.stdout.flush()
+        self.stdout.write(
+            f'\rrecipes: {done}, still without renditions: '
+            f'{Recipe.objects.filter(has_renditions=False).count()}')
@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import migrations
+
+
+def fill_timelines(apps, schema_editor):
+    """Push recent recipes of followed authors to existing followers."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    Subscription = apps.get_model('users', 'Subscription')
+    followers = Subscription.objects.order_by('user_id').values_list(
+        'user_id', flat=True).distinct()
+    for user_id in list(followers):
+        recipes = Recipe.objects.filter(
+            author__in=Subscription.objects.filter(
+                user_id=user_id).values('author_id'),
+            author__followers_count__lte=settings.TIMELINE_FANOUT_LIMIT)
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, created=created,
+                           recipe_id=recipe_id, author_id=author_id)
+             for created, recipe_id, author_id in recipes.order_by(
+                 '-created', '-id').values_list(
+                     'created', 'id', 'author_id')[
+                         :settings.TIMELINE_LENGTH]],
+            ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_counters'),
+        ('recipes', '0012_recipe_updated_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
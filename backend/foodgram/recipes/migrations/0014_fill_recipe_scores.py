@@ -0,0 +1,39 @@
+import math
+from datetime import datetime
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+SCORES = ('popular', 'trending')
+
+
+def fill_scores(apps, schema_editor):
+    """Score recipes without a score by their publication.
+
+    Favorites and cart adds are counted by the next refresh_scores run,
+    the rows are marked as updated at EPOCH for that.
+    """
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeScore = apps.get_model('recipes', 'RecipeScore')
+    weight = math.log2(settings.RECIPE_SCORE_WEIGHTS['recipe'])
+    recipes = Recipe.objects.filter(score__isnull=True).values_list(
+        'pk', 'created')
+    RecipeScore.objects.bulk_create(
+        RecipeScore(recipe_id=pk, updated=EPOCH, **{
+            name: weight + (created - EPOCH).total_seconds()
+            / settings.RECIPE_SCORE_HALF_LIVES[name] for name in SCORES})
+        for pk, created in recipes.iterator())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_fill_timelines'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,7 @@
 from django.core.validators import MinValueValidator
 from django.db import models
 
+from recipes.storage import ContentHashStorage
 from users.models import User
 
 
@@ -74,9 +75,16 @@ class Recipe(models.Model):
 
     image = models.ImageField(
         upload_to='recipes/',
+        storage=ContentHashStorage(),
         verbose_name='Картинка'
     )
 
+    has_renditions = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name='Уменьшенные копии картинки готовы'
+    )
+
     text = models.TextField(
         verbose_name='Описание'
     )
@@ -108,8 +116,32 @@ class Recipe(models.Model):
         verbose_name='Дата создания'
     )
 
+    updated = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество в избранном'
+    )
+
+    carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество в списках покупок'
+    )
+
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['-created', '-id'],
+                         name='recipe_created_id_idx'),
+            models.Index(fields=['author', '-created'],
+                         name='recipe_author_created_idx'),
+            models.Index(fields=['updated'], name='recipe_updated_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['author', 'name'],
@@ -136,10 +168,17 @@ class Favorite(models.Model):
         related_name='favorite',
         verbose_name='Рецепт',
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления'
+    )
 
     class Meta:
         verbose_name = 'избранное'
         verbose_name_plural = 'избранное'
+        indexes = [
+            models.Index(fields=['created'], name='favorite_created_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'recipe'],
@@ -161,10 +200,17 @@ class ShoppingCart(models.Model):
         related_name='cart',
         verbose_name='Рецепт',
     )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата добавления'
+    )
 
     class Meta:
         verbose_name = 'список покупок'
         verbose_name_plural = 'списки покупок'
+        indexes = [
+            models.Index(fields=['created'], name='cart_created_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'recipe'],
@@ -195,3 +241,72 @@ class IngredientRecipe(models.Model):
 
     def __str__(self):
         return f'{self.ingredient}: {self.amount}'
+
+
+class TimelineEntry(models.Model):
+    """Recipe pushed to the feed of a follower of its author."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пользователь',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    created = models.DateTimeField(
+        verbose_name='Дата публикации рецепта'
+    )
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'записи ленты'
+        indexes = [
+            models.Index(fields=['user', '-created', '-recipe'],
+                         name='timeline_user_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_user_timeline_recipe')
+        ]
+
+
+class RecipeScore(models.Model):
+    """Precomputed ranking of a recipe, see `recipes.scores`."""
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт',
+    )
+    popular = models.FloatField(
+        verbose_name='Популярность'
+    )
+    trending = models.FloatField(
+        verbose_name='Популярность за последние дни'
+    )
+    updated = models.DateTimeField(
+        verbose_name='Учтены события до'
+    )
+
+    class Meta:
+        verbose_name = 'рейтинг рецепта'
+        verbose_name_plural = 'рейтинги рецептов'
+        indexes = [
+            models.Index(fields=['-popular', '-recipe'],
+                         name='score_popular_idx'),
+            models.Index(fields=['-trending', '-recipe'],
+                         name='score_trending_idx'),
+            models.Index(fields=['updated'], name='score_updated_idx'),
+        ]
@@ -0,0 +1,173 @@
+"""Search of recipes by the ingredients a user already has.
+
+An inverted index maps every ingredient to the sorted array of recipes
+using it. Matches are counted by feeding the arrays of the requested
+ingredients to a Counter, which loops in C, and recipes are ranked by the
+share of their ingredients found, then by the number found. Until the
+index is built searches are answered by the database.
+"""
+import heapq
+import logging
+import threading
+from array import array
+from collections import Counter, namedtuple
+from datetime import timedelta
+from itertools import chain, groupby
+from operator import itemgetter, truediv
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from recipes.cache import RECIPES_VERSION, get_version
+from recipes.models import IngredientRecipe
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 10000
+
+# Recipes saved this long before a sync may still be uncommitted.
+LAG = timedelta(minutes=1)
+
+RecipeIndex = namedtuple(
+    'RecipeIndex', ('postings', 'sizes', 'changes', 'synced_at'))
+
+
+def make_index(postings, synced_at):
+    """Index sorted recipe id arrays keyed by ingredient id."""
+    counts = Counter(chain.from_iterable(postings.values()))
+    sizes = array('H', [0]) * (max(counts, default=0) + 1)
+    for recipe_id, count in counts.items():
+        sizes[recipe_id] = count
+    return RecipeIndex(postings, sizes, {}, synced_at)
+
+
+def rank(index, pantry, limit):
+    """Return up to `limit` (recipe id, matched, required) triples."""
+    matched = Counter()
+    for ingredient_id in pantry:
+        matched.update(index.postings.get(ingredient_id, ()))
+    changed = []
+    for recipe_id, ingredients in index.changes.items():
+        matched.pop(recipe_id, None)
+        count = len(ingredients & pantry)
+        if count:
+            changed.append(
+                (count / len(ingredients), count, recipe_id, len(ingredients)))
+    recipe_ids, counts = matched.keys(), matched.values()
+    required = list(map(index.sizes.__getitem__, recipe_ids))
+    top = heapq.nlargest(limit, chain(
+        zip(map(truediv, counts, required), counts, recipe_ids, required),
+        changed))
+    return [(recipe_id, count, size) for _, count, recipe_id, size in top]
+
+
+def search_database(pantry, limit):
+    """Rank recipes like `rank` does, with an aggregate query."""
+    found = IngredientRecipe.objects.filter(
+        ingredient_id__in=pantry).values('recipe_id')
+    rows = IngredientRecipe.objects.filter(recipe_id__in=found).values(
+        'recipe_id').annotate(
+            matched=Count('pk', filter=Q(ingredient_id__in=pantry)),
+            required=Count('pk'),
+    ).annotate(
+        share=ExpressionWrapper(
+            Cast('matched', FloatField()) / F('required'),
+            output_field=FloatField()),
+    ).order_by('-share', '-matched', '-recipe_id').values_list(
+        'recipe_id', 'matched', 'required')
+    return list(rows[:limit])
+
+
+class RecipeIngredientIndex:
+    """In-process inverted index of recipe ingredients.
+
+    Built on first use. Recipes saved since then, noticed by the recipes
+    version bump, are reloaded by `updated` time into a small overlay;
+    the index is rebuilt once the overlay grows past
+    RECIPE_INDEX_MAX_CHANGES recipes. Deleted recipes are put in the
+    overlay with no ingredients by `discard`. `warm_up` builds the index
+    in the background, searches made meanwhile go to the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = None
+
+    def build(self):
+        synced_at = timezone.now()
+        pairs = IngredientRecipe.objects.order_by(
+            'ingredient_id', 'recipe_id').values_list(
+                'ingredient_id', 'recipe_id').iterator(chunk_size=BATCH_SIZE)
+        postings = {
+            ingredient_id: array('I', map(itemgetter(1), group))
+            for ingredient_id, group in groupby(pairs, key=itemgetter(0))}
+        return make_index(postings, synced_at)
+
+    def sync(self, index):
+        synced_at = timezone.now()
+        pairs = IngredientRecipe.objects.filter(
+            recipe__updated__gt=index.synced_at - LAG).values_list(
+                'recipe_id', 'ingredient_id')
+        ingredients = {}
+        for recipe_id, ingredient_id in pairs:
+            ingredients.setdefault(recipe_id, set()).add(ingredient_id)
+        changes = dict(index.changes)
+        changes.update((recipe_id, frozenset(recipe_ingredients))
+                       for recipe_id, recipe_ingredients
+                       in ingredients.items())
+        if len(changes) > settings.RECIPE_INDEX_MAX_CHANGES:
+            return self.build()
+        return index._replace(changes=changes, synced_at=synced_at)
+
+    def discard(self, recipe_ids):
+        """Drop deleted recipes from search results."""
+        with self._lock:
+            if self._index is None:
+                return
+            changes = dict(self._index.changes)
+            changes.update((recipe_id, frozenset())
+                           for recipe_id in recipe_ids)
+            self._index = self._index._replace(changes=changes)
+
+    def refresh(self):
+        version = get_version(RECIPES_VERSION)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            self._index = (self.build() if self._index is None
+                           else self.sync(self._index))
+            self._version = version
+
+    def _warm_up(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('Failed to build recipe ingredient index')
+        finally:
+            connection.close()
+
+    def warm_up(self):
+        """Start building the index in a background thread."""
+        threading.Thread(target=self._warm_up, daemon=True).start()
+
+    def search(self, ingredient_ids, limit):
+        """Rank recipes by coverage with the given ingredients.
+
+        Returns (recipe id, matched, required) triples, recipes with the
+        largest share of their ingredients matched first.
+        """
+        pantry = frozenset(ingredient_ids)
+        if self._index is None and self._lock.locked():
+            # Don't wait for the first build.
+            return search_database(pantry, limit)
+        self.refresh()
+        return rank(self._index, pantry, limit)
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
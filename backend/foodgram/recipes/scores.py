@@ -0,0 +1,140 @@
+"""Popular and trending rankings of recipes.
+
+Publication of a recipe, every favorite and every shopping cart add
+contribute `weight * 2 ** ((time - EPOCH) / half_life)` to a score, so an
+older event counts half as much as one made `half_life` later. Scores
+are stored as base-2 logarithms of these sums: they never overflow, new
+events are added without rescaling the other rows, and scores of
+different recipes compare the same way at any moment.
+"""
+import math
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+from django.utils import timezone
+
+from recipes.models import Favorite, Recipe, RecipeScore, ShoppingCart
+
+EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+SCORES = ('popular', 'trending')
+
+EVENTS = ((Favorite, 'favorite'), (ShoppingCart, 'cart'))
+
+# Events younger than this may belong to transactions not committed yet.
+LAG = timedelta(minutes=1)
+
+
+def add_log2(first, second):
+    """Return log2(2 ** first + 2 ** second) without overflow."""
+    low, high = sorted((first, second))
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def get_values(moment, kind):
+    """Log2 contributions of one event to every score."""
+    weight = math.log2(settings.RECIPE_SCORE_WEIGHTS[kind])
+    seconds = (moment - EPOCH).total_seconds()
+    return tuple(weight + seconds / settings.RECIPE_SCORE_HALF_LIVES[name]
+                 for name in SCORES)
+
+
+def add_values(values, recipe_id, new):
+    old = values.get(recipe_id)
+    values[recipe_id] = new if old is None else tuple(
+        add_log2(first, second) for first, second in zip(old, new))
+
+
+def get_event_values(**filters):
+    """Sum contributions of favorites and cart adds per recipe."""
+    values = {}
+    for model, kind in EVENTS:
+        events = model.objects.filter(**filters).values_list(
+            'recipe_id', 'created').iterator()
+        for recipe_id, created in events:
+            add_values(values, recipe_id, get_values(created, kind))
+    return values
+
+
+def save_scores(values, until, batch_size):
+    if connection.vendor == 'sqlite':
+        # Django picks a batch size within SQLite limits on its own.
+        batch_size = None
+    existing = RecipeScore.objects.in_bulk(list(values))
+    scores = [RecipeScore(recipe_id=recipe_id, updated=until,
+                          **dict(zip(SCORES, recipe_values)))
+              for recipe_id, recipe_values in values.items()]
+    RecipeScore.objects.bulk_update(
+        [score for score in scores if score.pk in existing],
+        SCORES + ('updated',), batch_size=batch_size)
+    RecipeScore.objects.bulk_create(
+        [score for score in scores if score.pk not in existing],
+        batch_size=batch_size)
+
+
+def create_score(recipe):
+    """Score a new recipe by its publication until the next refresh.
+
+    The row counts no favorites or cart adds yet, so it is marked as
+    updated at EPOCH and does not move the watermark.
+    """
+    RecipeScore.objects.create(
+        recipe=recipe, updated=EPOCH,
+        **dict(zip(SCORES, get_values(recipe.created, 'recipe'))))
+
+
+def get_watermark():
+    """Time up to which events are already counted in the scores."""
+    return RecipeScore.objects.aggregate(until=Max('updated'))['until']
+
+
+def refresh_all(until, batch_size):
+    """Recompute scores of every recipe from all its events."""
+    last_id = 0
+    while True:
+        recipes = list(Recipe.objects.filter(pk__gt=last_id).order_by(
+            'pk').values_list('pk', 'created')[:batch_size])
+        if not recipes:
+            return
+        values = {pk: get_values(created, 'recipe')
+                  for pk, created in recipes}
+        events = get_event_values(
+            recipe_id__gte=recipes[0][0], recipe_id__lte=recipes[-1][0],
+            created__lte=until)
+        for recipe_id, event_values in events.items():
+            add_values(values, recipe_id, event_values)
+        save_scores(values, until, batch_size)
+        last_id = recipes[-1][0]
+
+
+def refresh_new(since, until, batch_size):
+    """Add events made since the last refresh and score new recipes."""
+    events = get_event_values(created__gt=since, created__lte=until)
+    values = {pk: get_values(created, 'recipe') for pk, created in
+              Recipe.objects.filter(score__isnull=True).values_list(
+                  'pk', 'created')}
+    scores = RecipeScore.objects.in_bulk(
+        [pk for pk in events if pk not in values])
+    for pk, score in scores.items():
+        values[pk] = tuple(getattr(score, name) for name in SCORES)
+    for recipe_id, event_values in events.items():
+        if recipe_id in values:
+            add_values(values, recipe_id, event_values)
+    save_scores(values, until, batch_size)
+
+
+def refresh_scores(full=False, batch_size=1000):
+    """Bring scores up to date, return the time they are valid for.
+
+    Removed favorites and cart items are only taken into account by
+    a full refresh.
+    """
+    until = timezone.now() - LAG
+    since = None if full else get_watermark()
+    if since is None:
+        refresh_all(until, batch_size)
+    else:
+        refresh_new(since, until, batch_size)
+    return until
@@ -0,0 +1,198 @@
+import bisect
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.contrib.postgres.lookups import TrigramSimilar
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection, transaction
+from django.db.models import Case, CharField, IntegerField, Q, Value, When
+
+from recipes.cache import INGREDIENTS_VERSION, get_version
+from recipes.models import Ingredient
+
+CharField.register_lookup(TrigramSimilar)
+
+INGREDIENT_FIELDS = ('id', 'name', 'measurement_unit')
+
+Index = namedtuple(
+    'Index', ('keys', 'items', 'words', 'word_positions', 'item_words',
+              'grams', 'gram_counts'))
+
+
+def normalize(value):
+    """Bring search key to a case-insensitive form (Cyrillic included)."""
+    return ' '.join(value.split()).casefold()
+
+
+def get_words(value):
+    return re.findall(r'\w+', normalize(value))
+
+
+def get_trigrams(value):
+    """Split value into trigrams the same way pg_trgm does."""
+    grams = set()
+    for word in get_words(value):
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def prefix_range(keys, prefix):
+    start = bisect.bisect_left(keys, prefix)
+    return start, bisect.bisect_left(keys, prefix + '\U0010ffff', start)
+
+
+class IngredientIndex:
+    """In-process index of ingredients for autocomplete.
+
+    Holds names sorted for prefix lookups, sorted name words for word
+    start lookups and trigram postings for typo-tolerant search. The index
+    is built once per worker and rebuilt after the ingredients version is
+    bumped or `INGREDIENT_INDEX_TTL` seconds have passed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._built_at = 0
+        self._index = Index([], [], [], [], [], {}, [])
+
+    def build(self):
+        items = sorted(
+            Ingredient.objects.values(*INGREDIENT_FIELDS),
+            key=lambda item: (normalize(item['name']),
+                              item['measurement_unit'], item['id']))
+        words = sorted(
+            (word, position) for position, item in enumerate(items)
+            for word in set(get_words(item['name'])))
+        grams, gram_counts = {}, []
+        for position, item in enumerate(items):
+            item_grams = get_trigrams(item['name'])
+            gram_counts.append(len(item_grams))
+            for gram in item_grams:
+                grams.setdefault(gram, []).append(position)
+        self._index = Index(
+            keys=[normalize(item['name']) for item in items],
+            items=items,
+            words=[word for word, _ in words],
+            word_positions=[position for _, position in words],
+            item_words=[tuple(get_words(item['name'])) for item in items],
+            grams=grams,
+            gram_counts=gram_counts,
+        )
+
+    def is_fresh(self, version):
+        return (version == self._version
+                and time.monotonic() - self._built_at
+                < settings.INGREDIENT_INDEX_TTL)
+
+    def refresh(self):
+        version = get_version(INGREDIENTS_VERSION)
+        if self.is_fresh(version):
+            return
+        with self._lock:
+            if self.is_fresh(version):
+                return
+            self.build()
+            self._version = version
+            self._built_at = time.monotonic()
+
+    def search(self, prefix='', limit=None):
+        """Return ingredients which names start with the given prefix."""
+        self.refresh()
+        index = self._index
+        start, end = prefix_range(index.keys, normalize(prefix))
+        if limit is not None:
+            end = min(end, start + limit)
+        return index.items[start:end]
+
+    @staticmethod
+    def word_start_positions(index, query):
+        first, *others = get_words(query)
+        start, end = prefix_range(index.words, first)
+        for position in sorted(set(index.word_positions[start:end])):
+            words = index.item_words[position]
+            if all(any(word.startswith(other) for word in words)
+                   for other in others):
+                yield position
+
+    @staticmethod
+    def similar_positions(index, query):
+        query_grams = get_trigrams(query)
+        shared = Counter()
+        for gram in query_grams:
+            shared.update(index.grams.get(gram, ()))
+        ranked = []
+        for position, count in shared.items():
+            similarity = count / (
+                len(query_grams) + index.gram_counts[position] - count)
+            if similarity >= settings.INGREDIENT_SEARCH_SIMILARITY:
+                ranked.append((-similarity, position))
+        return (position for _, position in sorted(ranked))
+
+    def search_ranked(self, query, limit=None):
+        """Return ingredients matching the query, best matches first.
+
+        Prefix matches go first, then names with words starting with every
+        query word, then names similar to the query by trigrams.
+        """
+        self.refresh()
+        index = self._index
+        if not get_words(query):
+            return self.search(query, limit)
+        found = dict.fromkeys(range(*prefix_range(
+            index.keys, normalize(query))))
+        for matches in (self.word_start_positions, self.similar_positions):
+            if limit is not None and len(found) >= limit:
+                break
+            for position in matches(index, query):
+                found.setdefault(position)
+        return [index.items[position] for position in list(found)[:limit]]
+
+
+ingredient_index = IngredientIndex()
+
+
+def get_ranked_queryset(query):
+    """Ranked ingredients search backed by pg_trgm.
+
+    Similar names are found by the `%` operator, which uses the trigram
+    index and compares with pg_trgm.similarity_threshold, see
+    `search_ingredients`.
+    """
+    # Case-insensitive regular expressions, unlike ILIKE on upper(), are
+    # served by the trigram index, so every condition below is.
+    prefix = Q(name__iregex=r'^' + re.escape(query))
+    word_start = Q()
+    for word in get_words(query):
+        word_start &= Q(name__iregex=r'(^|\W)' + re.escape(word))
+    return Ingredient.objects.annotate(
+        rank=Case(
+            When(prefix, then=Value(0)),
+            When(word_start, then=Value(1)),
+            default=Value(2),
+            output_field=IntegerField()),
+        similarity=TrigramSimilarity('name', query),
+    ).filter(
+        prefix | word_start | Q(name__trigram_similar=query)
+    ).order_by('rank', '-similarity', 'name').values(*INGREDIENT_FIELDS)
+
+
+def set_similarity_threshold():
+    """Match the in-process search threshold till the transaction ends."""
+    with connection.cursor() as cursor:
+        cursor.execute('SET LOCAL pg_trgm.similarity_threshold = %s',
+                       [settings.INGREDIENT_SEARCH_SIMILARITY])
+
+
+def search_ingredients(query, limit=None):
+    """Ranked ingredients search: pg_trgm on PostgreSQL, index elsewhere."""
+    query = normalize(query)
+    if connection.vendor != 'postgresql' or not get_words(query):
+        return ingredient_index.search_ranked(query, limit)
+    with transaction.atomic():
+        set_similarity_threshold()
+        return list(get_ranked_queryset(query)[:limit])
@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.cache import (INGREDIENTS_VERSION, RECIPES_VERSION, TAGS_VERSION,
+                           bump_version)
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.pantry import recipe_ingredient_index
+from recipes.scores import create_score
+from recipes.timeline import get_store
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredients_changed(**kwargs):
+    bump_version(INGREDIENTS_VERSION)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tags_changed(**kwargs):
+    bump_version(TAGS_VERSION)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def recipes_changed(**kwargs):
+    transaction.on_commit(lambda: bump_version(RECIPES_VERSION))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, raw, **kwargs):
+    # Fixtures bring their own rows of related tables.
+    if created and not raw:
+        create_score(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    recipe_id = instance.pk
+    get_store().remove_recipe(recipe_id)
+    transaction.on_commit(
+        lambda: recipe_ingredient_index.discard([recipe_id]))
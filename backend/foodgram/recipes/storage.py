@@ -0,0 +1,44 @@
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def get_content_hash(content):
+    sha256 = hashlib.sha256()
+    for chunk in content.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """File system storage which names files by SHA-256 of their content.
+
+    A file is saved as `<upload_to>/<first two hex digits>/<hash><ext>`,
+    so identical uploads share one file and a name never changes its
+    content, which makes the URL cacheable forever. Files no longer used
+    by any recipe are removed by the `collect_media` command.
+    """
+
+    def get_content_name(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        digest = get_content_hash(content)
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        try:
+            # A fresh mtime keeps collect_media from removing an orphan
+            # which a new recipe is about to use.
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            return super().save(name, content, max_length)
+        return name
@@ -0,0 +1,258 @@
+"""Synthetic datasets for benchmarks, load tests and capacity planning."""
+import io
+import random
+
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from rest_framework.authtoken.models import Token
+
+from recipes import timeline
+from recipes.counters import COUNTERS, count_related
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.scores import refresh_scores
+from users.models import Subscription, User
+
+PREFIX = 'synthetic'
+
+BATCH_SIZE = 1000
+
+COPY_ESCAPES = str.maketrans(
+    {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+TAGS = (
+    ('Завтрак', '#E26C2D', 'breakfast'),
+    ('Обед', '#49B64E', 'lunch'),
+    ('Ужин', '#8775D2', 'dinner'),
+)
+
+
+def copy(model, objects):
+    """Stream objects into the table with PostgreSQL COPY."""
+    fields = [field for field in model._meta.concrete_fields
+              if objects[0].pk is not None or not field.primary_key]
+    buffer = io.StringIO()
+    for obj in objects:
+        buffer.write('\t'.join(
+            copy_value(field.get_db_prep_save(
+                field.pre_save(obj, True), connection=connection))
+            for field in fields) + '\n')
+    buffer.seek(0)
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN',
+            buffer)
+
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    return str(value).translate(COPY_ESCAPES)
+
+
+def create(model, objects):
+    if not objects:
+        return
+    if connection.vendor == 'postgresql':
+        copy(model, objects)
+        return
+    # Django picks a batch size within SQLite limits on its own.
+    model.objects.bulk_create(objects, batch_size=(
+        None if connection.vendor == 'sqlite' else BATCH_SIZE))
+
+
+def get_last_id(model):
+    return model.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+def reset_sequences():
+    """Move id sequences past the explicitly assigned ids."""
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(
+                no_style(), [User, Recipe]):
+            cursor.execute(sql)
+
+
+def zipf_rank(rnd, count, exponent):
+    """Draw a rank in [0, count) with probability falling as
+    rank ** -exponent, by inverting the continuous distribution."""
+    if exponent == 1:
+        return min(count - 1, int((count + 1) ** rnd.random()) - 1)
+    power = 1 - exponent
+    rank = (((count + 1) ** power - 1) * rnd.random() + 1) ** (1 / power)
+    return min(count - 1, int(rank) - 1)
+
+
+def pick_ranks(rnd, count, size, exponent):
+    """Pick up to `size` distinct Zipf ranks."""
+    ranks = set()
+    for _ in range(size * 3):
+        if len(ranks) >= size:
+            break
+        ranks.add(zipf_rank(rnd, count, exponent))
+    return ranks
+
+
+def create_users(first_id, count, rnd):
+    """Create users with API tokens, return their ids."""
+    ids = range(first_id, first_id + count)
+    create(User, [
+        User(id=user_id, username=f'{PREFIX}{user_id}',
+             email=f'{PREFIX}{user_id}@foodgram.ru',
+             first_name='Имя', last_name='Фамилия', password='!')
+        for user_id in ids])
+    create(Token, [Token(key=f'{rnd.getrandbits(160):040x}', user_id=user_id)
+                   for user_id in ids])
+    return list(ids)
+
+
+def create_tags():
+    for name, color, slug in TAGS:
+        Tag.objects.get_or_create(
+            slug=slug, defaults={'name': name, 'color': color})
+    return list(Tag.objects.values_list('id', flat=True))
+
+
+def create_ingredients():
+    if not Ingredient.objects.exists():
+        call_command('load_ing', stdout=io.StringIO())
+    return list(Ingredient.objects.values_list('id', flat=True))
+
+
+def create_recipes(recipe_ids, author_ids, rnd):
+    create(Recipe, [
+        Recipe(id=recipe_id, author_id=author_id,
+               name=f'Рецепт {recipe_id}', image='recipes/synthetic.png',
+               text='Описание рецепта.', cooking_time=rnd.randint(5, 120))
+        for recipe_id, author_id in zip(recipe_ids, author_ids)])
+
+
+def create_recipe_relations(recipe_ids, tag_ids, ingredient_ids,
+                            ingredients_range, rnd):
+    through = Recipe.tags.through
+    tags, ingredients = [], []
+    for recipe_id in recipe_ids:
+        for tag_id in rnd.sample(tag_ids, rnd.randint(1, len(tag_ids))):
+            tags.append(through(recipe_id=recipe_id, tag_id=tag_id))
+        for ingredient_id in rnd.sample(
+                ingredient_ids, rnd.randint(*ingredients_range)):
+            ingredients.append(IngredientRecipe(
+                recipe_id=recipe_id, ingredient_id=ingredient_id,
+                amount=rnd.randint(1, 500)))
+        if len(ingredients) >= BATCH_SIZE * 10:
+            create(through, tags)
+            create(IngredientRecipe, ingredients)
+            tags, ingredients = [], []
+    create(through, tags)
+    create(IngredientRecipe, ingredients)
+
+
+def create_user_relations(model, field, user_ids, target_ids, per_user, rnd):
+    """Link every user to a random sample of targets."""
+    objects = []
+    for user_id in user_ids:
+        targets = rnd.sample(target_ids, min(per_user, len(target_ids)))
+        objects.extend(model(user_id=user_id, **{f'{field}_id': target_id})
+                       for target_id in targets if target_id != user_id)
+    create(model, objects)
+
+
+def create_skewed_relations(model, field, user_ids, first_target, targets,
+                            mean, exponent, rnd):
+    """Link users to targets: the number of links per user has a power-law
+    tail with the given mean, targets are picked by Zipf rank, so the
+    lowest ids are the most popular."""
+    objects = []
+    for user_id in user_ids:
+        size = min(targets, round(mean / 2 * rnd.paretovariate(2)))
+        objects.extend(
+            model(user_id=user_id, **{f'{field}_id': first_target + rank})
+            for rank in pick_ranks(rnd, targets, size, exponent)
+            if first_target + rank != user_id)
+        if len(objects) >= BATCH_SIZE * 10:
+            create(model, objects)
+            objects = []
+    create(model, objects)
+
+
+def update_counters():
+    for model, field, related_model, related_field in COUNTERS:
+        model.objects.update(
+            **{field: count_related(related_model, related_field)})
+
+
+def seed(users=100, recipes=1000, favorites=20, carts=5, subscriptions=10,
+         ingredients_range=(3, 10), seed=0):
+    """Fill an empty database with a reproducible dataset."""
+    rnd = random.Random(seed)
+    user_ids = create_users(get_last_id(User) + 1, users, rnd)
+    tag_ids = create_tags()
+    ingredient_ids = create_ingredients()
+    first_id = get_last_id(Recipe) + 1
+    recipe_ids = list(range(first_id, first_id + recipes))
+    create_recipes(recipe_ids, [rnd.choice(user_ids) for _ in recipe_ids],
+                   rnd)
+    create_recipe_relations(recipe_ids, tag_ids, ingredient_ids,
+                            ingredients_range, rnd)
+    create_user_relations(Favorite, 'recipe', user_ids, recipe_ids,
+                          favorites, rnd)
+    create_user_relations(ShoppingCart, 'recipe', user_ids, recipe_ids,
+                          carts, rnd)
+    create_user_relations(Subscription, 'author', user_ids, user_ids,
+                          subscriptions, rnd)
+    update_counters()
+    reset_sequences()
+    for user_id in user_ids:
+        timeline.rebuild(user_id)
+    refresh_scores(full=True)
+    return user_ids, recipe_ids
+
+
+def get_random(options, phase, start):
+    # Seeded per chunk, so the data does not depend on the process count.
+    return random.Random(f'{options["seed"]}:{phase}:{start}')
+
+
+def generate_users(start, stop, options):
+    create_users(start, stop - start, get_random(options, 'users', start))
+
+
+def generate_recipes(start, stop, options):
+    rnd = get_random(options, 'recipes', start)
+    recipe_ids = range(start, stop)
+    create_recipes(recipe_ids, [
+        options['first_user'] + zipf_rank(
+            rnd, options['users'], options['authors_exponent'])
+        for _ in recipe_ids], rnd)
+    create_recipe_relations(
+        recipe_ids, options['tag_ids'], options['ingredient_ids'],
+        options['ingredients_range'], rnd)
+
+
+def generate_user_relations(start, stop, options):
+    rnd = get_random(options, 'relations', start)
+    user_ids = range(start, stop)
+    for model, field, first, count, mean, exponent in (
+            (Favorite, 'recipe', options['first_recipe'],
+             options['recipes'], options['favorites'],
+             options['popularity_exponent']),
+            (ShoppingCart, 'recipe', options['first_recipe'],
+             options['recipes'], options['carts'],
+             options['popularity_exponent']),
+            (Subscription, 'author', options['first_user'],
+             options['users'], options['subscriptions'],
+             options['followers_exponent'])):
+        create_skewed_relations(model, field, user_ids, first, count, mean,
+                                exponent, rnd)
+
+
+def run_task(task):
+    """Generate one chunk of ids in its own transaction."""
+    function, start, stop, options = task
+    with transaction.atomic():
+        function(start, stop, options)
+    return stop - start
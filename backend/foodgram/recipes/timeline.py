@@ -0,0 +1,203 @@
+"""Per-user feeds of recipes from followed authors.
+
+Recipes are pushed to timelines of the author's followers when they are
+created (fan-out on write). Authors with more than TIMELINE_FANOUT_LIMIT
+followers are not pushed; their recipes are read and merged in when the
+feed is requested (fan-out on read). Timelines are trimmed to the newest
+TIMELINE_LENGTH entries whenever entries are pushed.
+"""
+import heapq
+import threading
+from functools import lru_cache
+from itertools import groupby, islice
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from recipes.models import Recipe, TimelineEntry
+from users.models import Subscription, User
+
+BATCH_SIZE = 1000
+
+
+def before(position):
+    """Filter rows strictly older than a (created, recipe id) position."""
+    created, pk = position
+    return Q(created__lt=created) | Q(created=created, recipe_id__lt=pk)
+
+
+class DatabaseStore:
+    """Timelines kept in the TimelineEntry table."""
+
+    def add(self, user_ids, entries):
+        """Push (created, recipe id, author id) entries to timelines."""
+        TimelineEntry.objects.bulk_create(
+            [TimelineEntry(user_id=user_id, created=created,
+                           recipe_id=recipe_id, author_id=author_id)
+             for user_id in user_ids
+             for created, recipe_id, author_id in entries],
+            ignore_conflicts=True)
+
+    def remove(self, user_id, author_ids):
+        TimelineEntry.objects.filter(
+            user_id=user_id, author_id__in=author_ids).delete()
+
+    def remove_recipe(self, recipe_id):
+        # Entries are deleted with the recipe by the foreign key cascade.
+        pass
+
+    def get(self, user_id, position, limit):
+        """Return (created, recipe id) pairs, newest first."""
+        entries = TimelineEntry.objects.filter(user_id=user_id)
+        if position is not None:
+            entries = entries.filter(before(position))
+        return list(entries.order_by('-created', '-recipe_id').values_list(
+            'created', 'recipe_id')[:limit])
+
+    def clear(self, user_id):
+        TimelineEntry.objects.filter(user_id=user_id).delete()
+
+    def trim(self, user_ids):
+        """Delete entries beyond TIMELINE_LENGTH with one statement."""
+        if not user_ids:
+            return
+        quote = connection.ops.quote_name
+        sql = (
+            'DELETE FROM {table} WHERE id IN ('
+            'SELECT id FROM (SELECT id, ROW_NUMBER() OVER ('
+            'PARTITION BY user_id ORDER BY created DESC, recipe_id DESC'
+            ') AS position FROM {table} WHERE user_id IN ({users})'
+            ') AS ranked WHERE position > %s)').format(
+                table=quote(TimelineEntry._meta.db_table),
+                users=', '.join(['%s'] * len(user_ids)))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*user_ids, settings.TIMELINE_LENGTH])
+
+
+class MemoryStore:
+    """Timelines kept in process memory, a stand-in for tests."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timelines = {}
+
+    def add(self, user_ids, entries):
+        with self.lock:
+            for user_id in user_ids:
+                timeline = self.timelines.setdefault(user_id, {})
+                for created, recipe_id, author_id in entries:
+                    timeline[recipe_id] = (created, author_id)
+
+    def remove(self, user_id, author_ids):
+        author_ids = {int(author_id) for author_id in author_ids}
+        with self.lock:
+            timeline = self.timelines.get(user_id, {})
+            for recipe_id, (_, author_id) in list(timeline.items()):
+                if author_id in author_ids:
+                    del timeline[recipe_id]
+
+    def remove_recipe(self, recipe_id):
+        with self.lock:
+            for timeline in self.timelines.values():
+                timeline.pop(recipe_id, None)
+
+    def get(self, user_id, position, limit):
+        with self.lock:
+            entries = sorted(
+                ((created, recipe_id) for recipe_id, (created, _)
+                 in self.timelines.get(user_id, {}).items()), reverse=True)
+        if position is not None:
+            entries = [entry for entry in entries if entry < position]
+        return entries[:limit]
+
+    def clear(self, user_id):
+        with self.lock:
+            self.timelines.pop(user_id, None)
+
+    def trim(self, user_ids):
+        for user_id in user_ids:
+            keep = set(pk for _, pk in self.get(
+                user_id, None, settings.TIMELINE_LENGTH))
+            with self.lock:
+                timeline = self.timelines.get(user_id, {})
+                for recipe_id in set(timeline) - keep:
+                    del timeline[recipe_id]
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    return import_string(settings.TIMELINE_STORE)()
+
+
+def get_pulled_authors(user_id):
+    """Followed authors whose recipes are not pushed to timelines."""
+    return Subscription.objects.filter(
+        user_id=user_id,
+        author__followers_count__gt=settings.TIMELINE_FANOUT_LIMIT,
+    ).values('author')
+
+
+def fan_out(recipe):
+    """Push a new recipe to timelines of the author's followers."""
+    if User.objects.filter(
+            pk=recipe.author_id,
+            followers_count__gt=settings.TIMELINE_FANOUT_LIMIT).exists():
+        return
+    followers = Subscription.objects.filter(
+        author_id=recipe.author_id).order_by('user_id')
+    entry = (recipe.created, recipe.pk, recipe.author_id)
+    last_id = 0
+    while True:
+        user_ids = list(followers.filter(user_id__gt=last_id).values_list(
+            'user_id', flat=True)[:BATCH_SIZE])
+        if not user_ids:
+            return
+        store = get_store()
+        store.add(user_ids, [entry])
+        store.trim(user_ids)
+        last_id = user_ids[-1]
+
+
+def follow(user_id, author_ids):
+    """Backfill the timeline with recent recipes of new followees."""
+    recipes = Recipe.objects.filter(author_id__in=author_ids).exclude(
+        author__followers_count__gt=settings.TIMELINE_FANOUT_LIMIT)
+    entries = list(recipes.order_by('-created', '-id').values_list(
+        'created', 'id', 'author_id')[:settings.TIMELINE_LENGTH])
+    if entries:
+        store = get_store()
+        store.add([user_id], entries)
+        store.trim([user_id])
+
+
+def unfollow(user_id, author_ids):
+    get_store().remove(user_id, author_ids)
+
+
+def rebuild(user_id):
+    """Fill the timeline from scratch from current subscriptions."""
+    author_ids = list(Subscription.objects.filter(
+        user_id=user_id).values_list('author_id', flat=True))
+    get_store().clear(user_id)
+    follow(user_id, author_ids)
+
+
+def get_feed(user_id, position, limit):
+    """Return (created, recipe id) pairs of the feed page, newest first.
+
+    Pushed entries are merged with recipes of followed authors that are
+    read on request.
+    """
+    pushed = get_store().get(user_id, position, limit)
+    pulled = Recipe.objects.filter(author__in=get_pulled_authors(user_id))
+    if position is not None:
+        pulled = pulled.filter(
+            Q(created__lt=position[0]) | Q(
+                created=position[0], pk__lt=position[1]))
+    pulled = list(pulled.order_by('-created', '-pk').values_list(
+        'created', 'pk')[:limit])
+    # An author may have been pushed before passing the fan-out limit.
+    merged = heapq.merge(pushed, pulled, reverse=True)
+    return [entry for entry, _ in islice(groupby(merged), limit)]
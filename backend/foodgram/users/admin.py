@@ -11,6 +11,8 @@ class UserAdmin(admin.ModelAdmin):
                     'last_name',
                     'is_active',
                     'last_login',
+                    'recipes_count',
+                    'followers_count',
                     )
     list_editable = ('is_active',)
     search_fields = ('username', 'email')
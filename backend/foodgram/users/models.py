@@ -20,6 +20,23 @@ class User(AbstractUser):
         max_length=150,
     )
 
+    recipes_count = models.PositiveIntegerField(
+        'количество рецептов',
+        default=0,
+        editable=False,
+    )
+
+    followers_count = models.PositiveIntegerField(
+        'количество подписчиков',
+        default=0,
+        editable=False,
+    )
+
+    updated = models.DateTimeField(
+        'дата изменения',
+        auto_now=True,
+    )
+
     class Meta:
         ordering = ['id']
         verbose_name = 'пользователь'